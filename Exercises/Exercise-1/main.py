@@ -2,6 +2,9 @@ import requests
 import os
 import zipfile
 from pathlib import Path
+
+from normalize import compact_downloads
+
 download_uris = [
     "https://divvy-tripdata.s3.amazonaws.com/Divvy_Trips_2018_Q4.zip",
     "https://divvy-tripdata.s3.amazonaws.com/Divvy_Trips_2019_Q1.zip",
@@ -61,6 +64,9 @@ def main():
         if download_file(url, zip_path):
             unzip_file(zip_path)
 
+     # Post-download stage: one canonical, month-partitioned Parquet dataset
+     compact_downloads(DOWNLOAD_DIR)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,179 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.dataset as ds
+
+DOWNLOAD_DIR = Path("downloads")
+PARQUET_DIR = Path("parquet") / "trips"
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Bytes of CSV per record batch, keeps memory bounded per worker
+READ_BLOCK_SIZE = 16 * 1024 * 1024
+
+# One canonical trip schema for every quarter (2020 naming, plus the older trip columns)
+CANONICAL_SCHEMA = pa.schema([
+    ("ride_id", pa.string()),
+    ("rideable_type", pa.string()),
+    ("started_at", pa.timestamp("s")),
+    ("ended_at", pa.timestamp("s")),
+    ("start_station_id", pa.int32()),
+    ("start_station_name", pa.string()),
+    ("end_station_id", pa.int32()),
+    ("end_station_name", pa.string()),
+    ("start_lat", pa.float64()),
+    ("start_lng", pa.float64()),
+    ("end_lat", pa.float64()),
+    ("end_lng", pa.float64()),
+    ("member_casual", pa.string()),
+    ("bike_id", pa.int32()),
+    ("duration_seconds", pa.float64()),
+    ("gender", pa.string()),
+    ("birth_year", pa.int32()),
+    ("source_file", pa.string()),
+    ("ride_month", pa.string()),
+])
+
+# Source header -> canonical column, for each layout Divvy used between 2018_Q4 and 2020_Q1
+HEADER_ALIASES = {
+    # 2018_Q4, 2019_Q1, 2019_Q3, 2019_Q4
+    "trip_id": "ride_id",
+    "start_time": "started_at",
+    "end_time": "ended_at",
+    "bikeid": "bike_id",
+    "tripduration": "duration_seconds",
+    "from_station_id": "start_station_id",
+    "from_station_name": "start_station_name",
+    "to_station_id": "end_station_id",
+    "to_station_name": "end_station_name",
+    "usertype": "member_casual",
+    "gender": "gender",
+    "birthyear": "birth_year",
+    # 2019_Q2 verbose headers
+    "01 - Rental Details Rental ID": "ride_id",
+    "01 - Rental Details Local Start Time": "started_at",
+    "01 - Rental Details Local End Time": "ended_at",
+    "01 - Rental Details Bike ID": "bike_id",
+    "01 - Rental Details Duration In Seconds Uncapped": "duration_seconds",
+    "03 - Rental Start Station ID": "start_station_id",
+    "03 - Rental Start Station Name": "start_station_name",
+    "02 - Rental End Station ID": "end_station_id",
+    "02 - Rental End Station Name": "end_station_name",
+    "User Type": "member_casual",
+    "Member Gender": "gender",
+    "05 - Member Details Member Birthday Year": "birth_year",
+}
+# 2020_Q1 already uses the canonical names
+HEADER_ALIASES.update({name: name for name in CANONICAL_SCHEMA.names})
+
+# Old "usertype" values -> 2020 "member_casual" values
+USER_TYPES = {"Subscriber": "member", "Customer": "casual"}
+
+
+def read_header(csv_path):
+    """Return the column names of a CSV file."""
+    reader = pv.open_csv(csv_path, read_options=pv.ReadOptions(block_size=1 << 16))
+    return reader.schema.names
+
+def build_column_map(header, csv_path):
+    """Map each source column onto the canonical schema, failing on unknown headers."""
+    unknown = [name for name in header if name.strip() not in HEADER_ALIASES]
+    if unknown:
+        raise ValueError(f"Unknown columns in {csv_path.name}: {unknown}")
+    return {name: HEADER_ALIASES[name.strip()] for name in header}
+
+def to_number(column, target_type):
+    """Cast a string column to a number; old files quote values like "1,061.0", bad values become null."""
+    cleaned = pc.replace_substring(column, ",", "")
+    is_number = pc.match_substring_regex(cleaned, r"^\s*-?\d+(\.\d*)?\s*$")
+    cleaned = pc.if_else(is_number, cleaned, pa.scalar(None, pa.string()))
+    return pc.cast(pc.cast(cleaned, pa.float64()), target_type, safe=False)
+
+def normalize_batch(batch, column_map, source_file):
+    """Rename, cast and complete one record batch so it matches CANONICAL_SCHEMA."""
+    columns = {column_map[name]: batch.column(name) for name in batch.schema.names}
+    length = batch.num_rows
+    arrays = []
+    for field in CANONICAL_SCHEMA:
+        column = columns.get(field.name)
+        if field.name == "source_file":
+            arrays.append(pa.array([source_file] * length, pa.string()))
+        elif field.name == "ride_month":
+            arrays.append(pc.strftime(arrays[CANONICAL_SCHEMA.get_field_index("started_at")], "%Y-%m"))
+        elif field.name == "duration_seconds" and column is None:
+            # 2020 files have no duration column, derive it from the timestamps
+            started = arrays[CANONICAL_SCHEMA.get_field_index("started_at")]
+            ended = arrays[CANONICAL_SCHEMA.get_field_index("ended_at")]
+            arrays.append(pc.cast(pc.cast(pc.subtract(ended, started), pa.int64()), pa.float64()))
+        elif column is None:
+            arrays.append(pa.nulls(length, field.type))
+        elif pa.types.is_timestamp(field.type):
+            arrays.append(pc.strptime(column, TIMESTAMP_FORMAT, "s", error_is_null=True))
+        elif field.name == "member_casual":
+            mapped = column
+            for old, new in USER_TYPES.items():
+                mapped = pc.if_else(pc.equal(mapped, old), new, mapped)
+            arrays.append(mapped)
+        elif pa.types.is_string(field.type):
+            arrays.append(pc.if_else(pc.equal(column, ""), pa.scalar(None, pa.string()), column))
+        else:
+            arrays.append(to_number(column, field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=CANONICAL_SCHEMA)
+
+def convert_file(csv_path, output_dir=PARQUET_DIR):
+    """
+    Stream one quarterly CSV into the month-partitioned dataset (ride_month=YYYY-MM).
+    Output files are named after the source. A rerun first deletes this source's files in
+    every month, so a month that now gets fewer files keeps no stale rows. Files of other
+    sources sharing a month are left alone, so workers can run in parallel.
+    """
+    csv_path = Path(csv_path)
+    for old_file in Path(output_dir).glob(f"ride_month=*/{csv_path.stem}-*.parquet"):
+        old_file.unlink()
+    header = read_header(csv_path)
+    column_map = build_column_map(header, csv_path)
+    # Read everything as text, casting is done once in normalize_batch
+    reader = pv.open_csv(
+        csv_path,
+        read_options=pv.ReadOptions(block_size=READ_BLOCK_SIZE),
+        convert_options=pv.ConvertOptions(column_types={name: pa.string() for name in header}),
+    )
+    rows = 0
+
+    def batches():
+        nonlocal rows
+        for batch in reader:
+            normalized = normalize_batch(batch, column_map, csv_path.name)
+            rows += normalized.num_rows
+            yield normalized
+
+    ds.write_dataset(
+        batches(),
+        output_dir,
+        schema=CANONICAL_SCHEMA,
+        format="parquet",
+        partitioning=ds.partitioning(pa.schema([("ride_month", pa.string())]), flavor="hive"),
+        basename_template=f"{csv_path.stem}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+    print(f"Converted: {csv_path.name} ({rows} rows)")
+    return rows
+
+def compact_downloads(download_dir=DOWNLOAD_DIR, output_dir=PARQUET_DIR, workers=None):
+    """Convert every downloaded CSV to Parquet, one worker process per file."""
+    csv_files = sorted(download_dir.glob("*.csv"))
+    if not csv_files:
+        print(f"No CSV files found in '{download_dir}'.")
+        return 0
+    output_dir.mkdir(parents=True, exist_ok=True)
+    workers = workers or min(len(csv_files), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        total = sum(pool.map(convert_file, csv_files, [output_dir] * len(csv_files)))
+    print(f"Wrote {total} rows from {len(csv_files)} files to '{output_dir}'.")
+    return total
+
+
+if __name__ == "__main__":
+    compact_downloads()
@@ -1,11 +1,15 @@
-from pyspark.sql import SparkSession
-from pyspark.sql.functions import (
-    col,
-    to_timestamp,
-    unix_timestamp,
-    sum as _sum,
-    date_format,
-)
+import json
+import logging
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from pyspark import StorageLevel
+from pyspark.sql import SparkSession, DataFrame, Column
+from pyspark.sql import functions as F
 from pyspark.sql.types import (
     StructType,
     StructField,
@@ -14,15 +18,60 @@ from pyspark.sql.types import (
     TimestampType,
 )
 
-# Create a SparkSession
-spark = SparkSession.builder.appName("BikeRideDuration").getOrCreate()
+# Shared Spark session factory (Exercises/shared, mounted at /shared in docker)
+sys.path.append(str(Path(__file__).resolve().parent.parent / "shared"))
+from spark_session import create_spark_session  # noqa: E402
+from spark_profiler import SparkProfiler  # noqa: E402
+
+# --- Logging ---
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+# --- Paths and settings ---
+INPUT_CSV_PATH = "data/202306-divvy-tripdata.csv"
+OUTPUT_PARQUET_PATH = "results/output_file.parquet"
+QUARANTINE_PARQUET_PATH = "results/quarantine.parquet"
+DQ_REPORT_PATH = Path("results") / "dq_report.json"
+# Spark fills this column with the raw line when a CSV row does not match the schema
+CORRUPT_RECORD_COLUMN = "_corrupt_record"
+QUARANTINE_REASON_COLUMN = "quarantine_reason"
+TIMESTAMP_FORMAT = "yyyy-MM-dd HH:mm:ss"
 
-# Define the schema based on the provided CSV structure
-schema = StructType([
+# A bike ride is expected to last at least a second and never more than a day
+MIN_DURATION_SECONDS = 1
+MAX_DURATION_SECONDS = 24 * 60 * 60
+# Mean Earth radius (IUGG), used by both haversine implementations
+EARTH_RADIUS_METERS = 6_371_008.8
+# Straight-line speed no bike ride can reach. Some rides only have coordinates
+# rounded to 0.01 degree (~1.1 km), so speed is only checked on rides of at
+# least MIN_SPEED_CHECK_DISTANCE_METERS, below that it is rounding noise.
+MAX_SPEED_KMH = 60
+MIN_SPEED_CHECK_DISTANCE_METERS = 2000
+# Rows compared against the NumPy reference, and the allowed difference: relative, since
+# JVM and NumPy trig round differently, plus a small absolute term for near-zero distances.
+# A mismatch only logs a warning, it does not block publishing.
+GEO_CHECK_SAMPLE_SIZE = int(os.getenv("GEO_CHECK_SAMPLE_SIZE", "1000"))
+GEO_CHECK_RTOL = 1e-9
+GEO_CHECK_ATOL_METERS = 1e-6
+# Number of failing rows kept per expectation in the report
+DQ_SAMPLE_SIZE = 5
+# Alert thresholds on the share of quarantined rows: above WARN log a warning,
+# above FAIL raise DataQualityError instead of publishing the daily aggregate
+QUARANTINE_WARN_RATIO = float(os.getenv("DQ_QUARANTINE_WARN_RATIO", "0"))
+QUARANTINE_FAIL_RATIO = float(os.getenv("DQ_QUARANTINE_FAIL_RATIO", "0.01"))
+
+# Define the schema based on the provided CSV structure.
+# Timestamps are parsed by the CSV reader (timestampFormat), an unparseable
+# value makes the row malformed and lands it in _corrupt_record.
+TRIP_SCHEMA = StructType([
     StructField("ride_id", StringType(), True),
     StructField("rideable_type", StringType(), True),
-    StructField("started_at", StringType(), True),
-    StructField("ended_at", StringType(), True),
+    StructField("started_at", TimestampType(), True),
+    StructField("ended_at", TimestampType(), True),
     StructField("start_station_name", StringType(), True),
     StructField("start_station_id", StringType(), True),
     StructField("end_station_name", StringType(), True),
@@ -32,37 +81,358 @@ schema = StructType([
     StructField("end_lat", DoubleType(), True),
     StructField("end_lng", DoubleType(), True),
     StructField("member_casual", StringType(), True),
+    StructField(CORRUPT_RECORD_COLUMN, StringType(), True),
 ])
 
-input_csv_path = "data/202306-divvy-tripdata.csv"
+# Columns copied into the failing-row samples of the report
+SAMPLE_COLUMNS = ["ride_id", "started_at", "ended_at", "duration_seconds", "distance_meters", "speed_kmh"]
+COORDINATE_COLUMNS = ["start_lat", "start_lng", "end_lat", "end_lng"]
 
-df = spark.read.csv(
-    input_csv_path,
-    header=True,
-    schema=schema,
-    mode="DROPMALFORMED"
-)
 
-df = df.withColumn(
-    "started_at", to_timestamp(col("started_at"), "yyyy-MM-dd HH:mm:ss")
-).withColumn(
-    "ended_at", to_timestamp(col("ended_at"), "yyyy-MM-dd HH:mm:ss")
-)
+class DataQualityError(Exception):
+    """Raised when at least one expectation of the suite fails."""
 
-df = df.withColumn(
-    "duration_seconds",
-    unix_timestamp(col("ended_at")) - unix_timestamp(col("started_at"))
-)
 
-df = df.withColumn(
-    "date", date_format(col("started_at"), "yyyy-MM-dd")
-)
+# --- Pipeline ---
 
-daily_durations = df.groupBy("date").agg(
-    _sum("duration_seconds").alias("total_duration_seconds")
-)
+def read_trips(spark: SparkSession, path: str = INPUT_CSV_PATH) -> DataFrame:
+    """
+    Read the Divvy CSV with started_at/ended_at typed as TimestampType by the reader.
+    PERMISSIVE keeps malformed rows (raw line in _corrupt_record) so they are
+    quarantined instead of being silently dropped.
+    """
+    return spark.read.csv(path, header=True, schema=TRIP_SCHEMA, mode="PERMISSIVE",
+                          timestampFormat=TIMESTAMP_FORMAT,
+                          columnNameOfCorruptRecord=CORRUPT_RECORD_COLUMN)
+
+def add_durations(df: DataFrame) -> DataFrame:
+    """Add duration_seconds and the ride date (DateType, from started_at)."""
+    return df.withColumn(
+        "duration_seconds",
+        F.unix_timestamp("ended_at") - F.unix_timestamp("started_at")
+    ).withColumn(
+        "date", F.to_date("started_at")
+    )
+
+def haversine_meters(lat1: Column, lng1: Column, lat2: Column, lng2: Column) -> Column:
+    """Great-circle distance in meters, as a native column expression (no Python UDF)."""
+    lat1, lng1, lat2, lng2 = (F.radians(c) for c in (lat1, lng1, lat2, lng2))
+    a = F.pow(F.sin((lat2 - lat1) / 2), 2) \
+        + F.cos(lat1) * F.cos(lat2) * F.pow(F.sin((lng2 - lng1) / 2), 2)
+    return F.lit(2 * EARTH_RADIUS_METERS) * F.asin(F.sqrt(a))
+
+def add_geo_metrics(df: DataFrame) -> DataFrame:
+    """
+    Add distance_meters (start to end point) and the implied speed_kmh in one
+    projection; both are null when a coordinate is missing, speed also when the
+    duration is not positive.
+    """
+    distance = haversine_meters(*(F.col(c) for c in COORDINATE_COLUMNS))
+    return df.withColumns({
+        "distance_meters": distance,
+        "speed_kmh": F.when(F.col("duration_seconds") > 0,
+                            distance / F.col("duration_seconds") * 3.6),
+    })
+
+def daily_durations(df: DataFrame) -> DataFrame:
+    """Total ride duration and distance aggregates per day."""
+    return df.groupBy("date").agg(
+        F.sum("duration_seconds").alias("total_duration_seconds"),
+        F.sum("distance_meters").alias("total_distance_meters"),
+        F.avg("distance_meters").alias("avg_distance_meters"),
+        F.max("distance_meters").alias("max_distance_meters"),
+    )
+
+def write_by_date(df: DataFrame, path: str):
+    """
+    Write df partitioned by date with dynamic partition overwrite: only the
+    date=... partitions present in df are replaced, other days stay untouched,
+    so reprocessing one day's input rewrites one partition and reruns are idempotent.
+    """
+    df.sparkSession.conf.set("spark.sql.sources.partitionOverwriteMode", "dynamic")
+    df.write \
+        .mode("overwrite") \
+        .partitionBy("date") \
+        .parquet(path)
+
+def clear_date_partitions(spark: SparkSession, path: str, dates: List) -> int:
+    """
+    Delete the date=... partitions of path for the given dates (None is the null-date
+    partition). Dynamic overwrite only replaces dates that have rows in the new output,
+    so an output that can be empty for a date (quarantine) is cleared first.
+    Goes through the Hadoop FileSystem so it works for any path Spark writes to.
+    Returns the number of partitions deleted.
+    """
+    hadoop_path = spark.sparkContext._jvm.org.apache.hadoop.fs.Path
+    base = hadoop_path(path)
+    fs = base.getFileSystem(spark.sparkContext._jsc.hadoopConfiguration())
+    deleted = 0
+    for day in dates:
+        partition = hadoop_path(base, f"date={'__HIVE_DEFAULT_PARTITION__' if day is None else day}")
+        if fs.exists(partition):
+            fs.delete(partition, True)
+            deleted += 1
+    return deleted
+
+
+# --- Data quality ---
+
+def build_expectation_suite() -> List[Dict]:
+    """
+    Declarative suite: each expectation is a Column that is true for a valid row.
+    A null result (e.g. a duration computed from a null timestamp) is not counted
+    as a failure, the not-null expectations report those rows instead.
+    `mostly` is the minimum fraction of rows that must pass, as in Great Expectations.
+    Rows failing an expectation with a `quarantine_reason` are moved to quarantine.
+    An expectation with severity "warning" is reported but never blocks publishing.
+    """
+    return [
+        {
+            "name": "expect_column_values_to_be_null",
+            "column": CORRUPT_RECORD_COLUMN,
+            "condition": F.col(CORRUPT_RECORD_COLUMN).isNull(),
+            "mostly": 1.0,
+            "quarantine_reason": "malformed_record",
+        },
+        {
+            "name": "expect_column_values_to_not_be_null",
+            "column": "started_at",
+            "condition": F.col("started_at").isNotNull(),
+            "mostly": 1.0,
+            "quarantine_reason": "null_started_at",
+        },
+        {
+            "name": "expect_column_values_to_not_be_null",
+            "column": "ended_at",
+            "condition": F.col("ended_at").isNotNull(),
+            "mostly": 1.0,
+            "quarantine_reason": "null_ended_at",
+        },
+        {
+            "name": "expect_column_pair_values_a_to_be_greater_than_b",
+            "column": "ended_at,started_at",
+            "condition": F.col("ended_at") >= F.col("started_at"),
+            "mostly": 1.0,
+            "quarantine_reason": "ended_before_started",
+        },
+        {
+            "name": "expect_column_pair_values_to_be_equal",
+            "column": "to_date(started_at),to_date(ended_at)",
+            "condition": F.to_date("started_at") == F.to_date("ended_at"),
+            # Rides crossing midnight are legitimate data (one busy night can exceed 1%),
+            # so a high share is only worth a warning
+            "mostly": 0.99,
+            "severity": "warning",
+        },
+        {
+            "name": "expect_column_values_to_be_between",
+            "column": "duration_seconds",
+            "condition": F.col("duration_seconds").between(MIN_DURATION_SECONDS, MAX_DURATION_SECONDS),
+            "mostly": 1.0,
+            "kwargs": {"min_value": MIN_DURATION_SECONDS, "max_value": MAX_DURATION_SECONDS},
+            "quarantine_reason": "duration_out_of_bounds",
+        },
+        {
+            "name": "expect_column_values_to_be_between",
+            "column": "speed_kmh",
+            "condition": (F.col("distance_meters") < MIN_SPEED_CHECK_DISTANCE_METERS)
+            | (F.col("speed_kmh") <= MAX_SPEED_KMH),
+            "mostly": 1.0,
+            "kwargs": {"max_value": MAX_SPEED_KMH,
+                       "min_distance_meters": MIN_SPEED_CHECK_DISTANCE_METERS},
+            "quarantine_reason": "impossible_speed",
+        },
+    ]
+
+def failed_condition(expectation: Dict) -> Column:
+    """True when the row fails the expectation (a null condition counts as passing)."""
+    return F.coalesce(~expectation["condition"], F.lit(False))
+
+def tag_quarantine(df: DataFrame, suite: List[Dict]) -> DataFrame:
+    """
+    Add quarantine_reason: the ;-joined reasons of every quarantining expectation
+    the row fails, or null for a clean row. Splitting on this column keeps clean
+    and quarantined rows in the same pass over the input.
+    """
+    reasons = [
+        F.when(failed_condition(e), F.lit(e["quarantine_reason"]))
+        for e in suite if e.get("quarantine_reason")
+    ]
+    joined = F.concat_ws(";", *reasons)
+    return df.withColumn(QUARANTINE_REASON_COLUMN, F.when(joined != "", joined))
+
+def split_quarantine(tagged: DataFrame):
+    """Return (clean, quarantined) views of a df tagged by tag_quarantine."""
+    is_quarantined = F.col(QUARANTINE_REASON_COLUMN).isNotNull()
+    clean = tagged.filter(~is_quarantined).drop(QUARANTINE_REASON_COLUMN, CORRUPT_RECORD_COLUMN)
+    return clean, tagged.filter(is_quarantined)
+
+def validate(df: DataFrame, suite: List[Dict], sample_size: int = DQ_SAMPLE_SIZE) -> Dict:
+    """
+    Evaluate the whole suite in a single aggregation over df.
+    Per expectation: unexpected count and up to sample_size failing rows. Rows are
+    spread over sample_size buckets by hash(ride_id) and F.min keeps one failing row
+    per bucket, so only the small aggregate ever reaches the driver.
+    If df is tagged by tag_quarantine, the quarantined row count is computed in the same pass.
+    """
+    bucket = F.pmod(F.xxhash64("ride_id"), F.lit(sample_size))
+    sample_row = F.struct(*SAMPLE_COLUMNS)
+    aggregations = [F.count(F.lit(1)).alias("row_count")]
+    tagged = QUARANTINE_REASON_COLUMN in df.columns
+    if tagged:
+        aggregations.append(F.count(QUARANTINE_REASON_COLUMN).alias("quarantined_count"))
+    for i, expectation in enumerate(suite):
+        failed = failed_condition(expectation)
+        aggregations.append(F.sum(failed.cast("long")).alias(f"unexpected_{i}"))
+        aggregations.extend(
+            F.min(F.when(failed & (bucket == b), sample_row)).alias(f"sample_{i}_{b}")
+            for b in range(sample_size)
+        )
+
+    metrics = df.agg(*aggregations).first()
+    row_count = metrics["row_count"]
+    results = []
+    for i, expectation in enumerate(suite):
+        unexpected = metrics[f"unexpected_{i}"] or 0
+        unexpected_fraction = unexpected / row_count if row_count else 0.0
+        samples = [metrics[f"sample_{i}_{b}"] for b in range(sample_size)]
+        results.append({
+            "expectation": expectation["name"],
+            "column": expectation["column"],
+            "kwargs": expectation.get("kwargs", {}),
+            "mostly": expectation["mostly"],
+            "quarantine_reason": expectation.get("quarantine_reason"),
+            "severity": expectation.get("severity", "error"),
+            "unexpected_count": unexpected,
+            "unexpected_percent": round(100 * unexpected_fraction, 4),
+            "success": 1 - unexpected_fraction >= expectation["mostly"],
+            "failing_samples": [s.asDict() for s in samples if s is not None],
+        })
+
+    report = {
+        "run_time": datetime.now().isoformat(timespec="seconds"),
+        "row_count": row_count,
+        "success": all(r["success"] for r in results),
+        "results": results,
+    }
+    if tagged:
+        quarantined = metrics["quarantined_count"]
+        report["quarantined_count"] = quarantined
+        report["quarantine_ratio"] = quarantined / row_count if row_count else 0.0
+    return report
+
+def haversine_meters_numpy(lat1: np.ndarray, lng1: np.ndarray,
+                           lat2: np.ndarray, lng2: np.ndarray) -> np.ndarray:
+    """NumPy reference for haversine_meters, vectorised over whole arrays."""
+    lat1, lng1, lat2, lng2 = (np.radians(c) for c in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(a))
+
+def cross_check_geo(df: DataFrame, sample_size: int = GEO_CHECK_SAMPLE_SIZE,
+                    rtol: float = GEO_CHECK_RTOL, atol: float = GEO_CHECK_ATOL_METERS) -> Dict:
+    """
+    Compare the Spark distances of up to sample_size rows against the NumPy reference.
+    Rows are picked by hash(ride_id) so the sample is spread over the whole input,
+    and only the sample (coordinates + distance) is collected to the driver.
+    """
+    rows = df.select(*COORDINATE_COLUMNS, "distance_meters") \
+        .where(F.col("distance_meters").isNotNull()) \
+        .orderBy(F.xxhash64("ride_id")) \
+        .limit(sample_size) \
+        .collect()
+    if not rows:
+        return {"sample_size": 0, "max_abs_diff_meters": 0.0, "success": True}
+    values = np.array(rows, dtype=np.float64)
+    expected = haversine_meters_numpy(*values[:, :4].T)
+    diff = np.abs(values[:, 4] - expected)
+    return {
+        "sample_size": len(rows),
+        "max_abs_diff_meters": float(diff.max()),
+        "success": bool(np.allclose(values[:, 4], expected, rtol=rtol, atol=atol)),
+    }
+
+def check_thresholds(report: Dict, warn_ratio: float = QUARANTINE_WARN_RATIO,
+                     fail_ratio: float = QUARANTINE_FAIL_RATIO) -> Optional[str]:
+    """
+    Decide whether the run can publish. Failed expectations whose rows are quarantined
+    only count through the quarantine ratio; warning-severity expectations and the
+    geo cross-check are only logged; any other failed expectation is fatal.
+    Returns the failure message, or None when the run may publish.
+    """
+    ratio = report.get("quarantine_ratio", 0.0)
+    if ratio > fail_ratio:
+        return (f"Quarantine ratio {ratio:.4%} exceeds the fail threshold {fail_ratio:.4%} "
+                f"({report['quarantined_count']} of {report['row_count']} rows)")
+    if ratio > warn_ratio:
+        logger.warning(f"Quarantine ratio {ratio:.4%} exceeds the warn threshold {warn_ratio:.4%} "
+                       f"({report['quarantined_count']} of {report['row_count']} rows)")
+
+    for r in report["results"]:
+        if not r["success"] and r["severity"] == "warning":
+            logger.warning(f"Expectation {r['expectation']}({r['column']}) below mostly={r['mostly']}: "
+                           f"{r['unexpected_percent']}% unexpected")
+    failed = [r["expectation"] for r in report["results"]
+              if not r["success"] and not r["quarantine_reason"] and r["severity"] != "warning"]
+    if failed:
+        return f"{len(failed)} expectation(s) failed: {failed}"
+    geo_check = report.get("geo_cross_check")
+    if geo_check and not geo_check["success"]:
+        logger.warning(f"Spark distances differ from the NumPy reference by up to "
+                       f"{geo_check['max_abs_diff_meters']} m (rtol={GEO_CHECK_RTOL}, "
+                       f"atol={GEO_CHECK_ATOL_METERS} m)")
+    return None
+
+def write_dq_report(report: Dict, path: Path = DQ_REPORT_PATH):
+    """Write the validation report as JSON (timestamps serialized as strings)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(report, indent=2, default=str), encoding="utf-8")
+    logger.info(f"Data quality report written to {path}")
+
+def log_dq_summary(report: Dict):
+    for result in report["results"]:
+        status = "PASS" if result["success"] else "WARN" if result["severity"] == "warning" else "FAIL"
+        logger.info(f"[{status}] {result['expectation']}({result['column']}): "
+                    f"{result['unexpected_count']} unexpected ({result['unexpected_percent']}%)")
+
+
+def main():
+    spark = create_spark_session("BikeRideDuration", input_paths=[INPUT_CSV_PATH])
+    profiler = SparkProfiler(spark, "exercise10")
+    try:
+        suite = build_expectation_suite()
+        # Tagged once and persisted: validation, quarantine output and the daily
+        # aggregation all reuse this single scan of the CSV
+        tagged = tag_quarantine(add_geo_metrics(add_durations(read_trips(spark))), suite) \
+            .persist(StorageLevel.MEMORY_AND_DISK)
+
+        # The first action also reads the CSV and fills the persisted cache
+        with profiler.step("read_and_validate"):
+            report = validate(tagged, suite)
+        with profiler.step("geo_cross_check"):
+            report["geo_cross_check"] = cross_check_geo(tagged)
+        write_dq_report(report)
+        log_dq_summary(report)
+
+        clean, quarantined = split_quarantine(tagged)
+        with profiler.step("write_quarantine"):
+            # A rerun that quarantines nothing for a date must still drop that date's old rows
+            input_dates = [row["date"] for row in tagged.select("date").distinct().collect()]
+            clear_date_partitions(spark, QUARANTINE_PARQUET_PATH, input_dates)
+            write_by_date(quarantined, QUARANTINE_PARQUET_PATH)
+        logger.info(f"{report['quarantined_count']} quarantined rows written to {QUARANTINE_PARQUET_PATH}")
+
+        failure = check_thresholds(report)
+        if failure:
+            raise DataQualityError(f"{failure}. See {DQ_REPORT_PATH}")
 
-output_parquet_path = "results/output_file.parquet"
-daily_durations.write.mode("overwrite").parquet(output_parquet_path)
+        with profiler.step("write_daily_durations"):
+            write_by_date(daily_durations(clean), OUTPUT_PARQUET_PATH)
+        logger.info(f"Daily durations (clean rows only) written to {OUTPUT_PARQUET_PATH}")
+    finally:
+        if profiler.steps:
+            profiler.write_report()
+        spark.stop()
 
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+ARCHIVE_DIR = Path("archive") / "lcd"
+# Cột định danh giữ lại trong archive, cùng với mọi cột Hourly*
+ID_COLUMNS = ["STATION", "DATE", "LATITUDE", "LONGITUDE", "ELEVATION", "NAME", "REPORT_TYPE", "SOURCE"]
+# Cột Hourly* dạng văn bản (mã thời tiết, tầng mây), không tách giá trị số
+HOURLY_TEXT_COLUMNS = {"HourlyPresentWeatherType", "HourlySkyConditions"}
+# Giá trị LCD: số (có thể rỗng) + hậu tố/cờ, ví dụ "45", "45s" (suspect), "M" (missing),
+# "T" (trace), "*", "VRB" (hướng gió thay đổi), "0.05A"
+VALUE_PATTERN = r"^\s*(?P<value>[-+]?(?:\d+\.?\d*|\.\d+))?\s*(?P<flag>[^\d\s.+-][^\s]*)?\s*$"
+# Lượng mưa "T" (trace): có mưa nhưng không đo được -> 0.0, cờ vẫn giữ "T"
+TRACE_FLAG = "T"
+TRACE_COLUMNS = {"HourlyPrecipitation"}
+SUSPECT_FLAGS = ("s",)
+FLAG_SUFFIX = "Flag"
+# Partition của archive; STATION khai báo kiểu chuỗi để không mất số 0 ở đầu khi đọc lại
+PARTITIONING = ds.partitioning(pa.schema([("STATION", pa.string()), ("year", pa.int16())]), flavor="hive")
+
+
+def read_raw(file_path):
+    """Đọc CSV LCD, mọi cột dạng chuỗi pyarrow để các phép str.* chạy vector hóa trên Arrow."""
+    return pd.read_csv(file_path, dtype="string[pyarrow]", keep_default_na=False, na_values=[""])
+
+def split_value_flag(series, trace_as_zero=False):
+    """
+    Tách một cột LCD thành (giá trị float, cờ chất lượng) bằng một lần str.extract (không apply).
+    Giá trị không khớp định dạng thành NaN, phần gốc được giữ làm cờ để không mất thông tin.
+    """
+    parts = series.str.extract(VALUE_PATTERN)
+    values = pd.to_numeric(parts["value"], errors="coerce").astype("float64")
+    flags = parts["flag"].astype("string[pyarrow]")
+    unmatched = series.notna() & parts["value"].isna() & parts["flag"].isna()
+    flags = flags.mask(unmatched, series.str.strip())
+    if trace_as_zero:
+        values = values.mask((flags == TRACE_FLAG).fillna(False), 0.0)
+    return values, flags
+
+def clean_lcd(df):
+    """
+    Chuẩn hóa một file LCD: mỗi cột Hourly* số -> <cột> (float64) + <cột>Flag (chuỗi hoặc NA),
+    DATE -> datetime, thêm cột year để partition. Chỉ giữ ID_COLUMNS và các cột Hourly*.
+    """
+    columns = {}
+    for name in ID_COLUMNS:
+        if name in df.columns:
+            columns[name] = df[name]
+    for name in (c for c in df.columns if c.startswith("Hourly")):
+        if name in HOURLY_TEXT_COLUMNS:
+            columns[name] = df[name]
+            continue
+        columns[name], columns[name + FLAG_SUFFIX] = split_value_flag(df[name], name in TRACE_COLUMNS)
+    for name in ("LATITUDE", "LONGITUDE", "ELEVATION"):
+        if name in columns:
+            columns[name] = pd.to_numeric(columns[name], errors="coerce")
+    clean = pd.DataFrame(columns)
+    clean["DATE"] = pd.to_datetime(clean["DATE"], format="%Y-%m-%dT%H:%M:%S", errors="coerce")
+    clean["year"] = clean["DATE"].dt.year.astype("Int16")
+    return clean
+
+def append_to_archive(clean, source_name, archive_dir=ARCHIVE_DIR):
+    """
+    Ghi file đã làm sạch vào archive Parquet partition theo STATION/year.
+    Tên file theo file nguồn nên nạp lại cùng một file chỉ ghi đè file của chính nó.
+    """
+    table = pa.Table.from_pandas(clean, preserve_index=False)
+    ds.write_dataset(
+        table,
+        archive_dir,
+        format="parquet",
+        partitioning=PARTITIONING,
+        basename_template=f"{source_name}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+    print(f"🗄️  Archived {len(clean)} rows from {source_name} to {archive_dir}")
+
+def read_archive(columns, stations=None, years=None, archive_dir=ARCHIVE_DIR):
+    """Đọc archive: chỉ các cột cần thiết, bỏ qua partition ngoài stations/years."""
+    dataset = ds.dataset(archive_dir, format="parquet", partitioning=PARTITIONING)
+    condition = None
+    if stations:
+        condition = ds.field("STATION").isin([str(s) for s in stations])
+    if years:
+        year_filter = ds.field("year").isin(list(years))
+        condition = year_filter if condition is None else condition & year_filter
+    return dataset.to_table(columns=columns, filter=condition).to_pandas()
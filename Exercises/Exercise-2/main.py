@@ -1,7 +1,8 @@
 import requests
-import pandas as pd
 from bs4 import BeautifulSoup
 from pathlib import Path
+
+from lcd_archive import SUSPECT_FLAGS, FLAG_SUFFIX, append_to_archive, clean_lcd, read_archive, read_raw
 BASE_URL = "https://www.ncei.noaa.gov/data/local-climatological-data/access/2021/"
 TARGET_TIMESTAMP = "2024-01-19 10:27"  # Dấu thời gian cần tìm
 DOWNLOAD_DIR = Path("downloads")
@@ -39,16 +40,27 @@ def download_file(filename):
     print(f"✅ File saved to: {dest_path}")
     return dest_path
 
-def analyze_temperature(file_path):
-    """Phân tích dữ liệu nhiệt độ"""
-    df = pd.read_csv(file_path)
+def archive_file(file_path):
+    """Làm sạch file LCD (giá trị số + cờ chất lượng) và ghi vào archive Parquet"""
+    clean = clean_lcd(read_raw(file_path))
+    append_to_archive(clean, Path(file_path).stem)
+    return clean["STATION"].dropna().unique().tolist()
 
-    if 'HourlyDryBulbTemperature' not in df.columns:
-        raise ValueError("❌ Cột 'HourlyDryBulbTemperature' không tồn tại trong file.")
+def analyze_temperature(stations=None, exclude_flags=SUSPECT_FLAGS):
+    """Phân tích dữ liệu nhiệt độ (cột số đã làm sạch trong archive, bỏ giá trị bị gắn cờ suspect)"""
+    column = 'HourlyDryBulbTemperature'
+    flag_column = column + FLAG_SUFFIX
+    try:
+        df = read_archive(['STATION', 'DATE', column, flag_column], stations=stations)
+    except (KeyError, ValueError) as e:
+        raise ValueError(f"❌ Cột '{column}' không tồn tại trong archive.") from e
 
-    df_clean = df.dropna(subset=['HourlyDryBulbTemperature'])
-    max_temp = df_clean['HourlyDryBulbTemperature'].max()
-    max_rows = df_clean[df_clean['HourlyDryBulbTemperature'] == max_temp]
+    suspect = df[flag_column].isin(exclude_flags).fillna(False)
+    if suspect.any():
+        print(f"⚠️  Bỏ qua {int(suspect.sum())} giá trị bị gắn cờ {exclude_flags}")
+    df_clean = df[~suspect].dropna(subset=[column])
+    max_temp = df_clean[column].max()
+    max_rows = df_clean[df_clean[column] == max_temp]
 
     print(f"\n🌡️  Max HourlyDryBulbTemperature: {max_temp}")
     print("📊 Rows with highest temperature:")
@@ -66,8 +78,11 @@ def main():
     print("📥 Downloading data...")
     file_path = download_file(filename)
 
+    print("🧹 Cleaning and archiving...")
+    stations = archive_file(file_path)
+
     print("📊 Analyzing temperature data...")
-    analyze_temperature(file_path)
+    analyze_temperature(stations)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,314 @@
+import os
+import re
+import sqlite3
+import zlib
+
+import numpy as np
+
+# --- Cấu hình ---
+DEDUP_DB = os.getenv("DEDUP_DB", "dedup/minhash_index.sqlite")
+# Shingle = SHINGLE_SIZE từ liên tiếp (sau khi lowercase)
+SHINGLE_SIZE = 5
+NUM_PERM = 128
+# Ngưỡng Jaccard mà LSH nhắm tới khi tìm ứng viên; các cặp có độ tương đồng ước lượng
+# >= ngưỡng này được lưu, nên báo cáo có thể dùng mọi ngưỡng >= LSH_THRESHOLD
+LSH_THRESHOLD = 0.5
+# Ngưỡng mặc định khi báo cáo cụm trùng lặp
+REPORT_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.8"))
+BATCH_SIZE = 1000
+# Seed cố định: chữ ký phải giống nhau giữa các lần chạy để so được với index cũ
+SEED = 1
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+# Số shingle tối đa tính cùng lúc: ma trận (chunk x NUM_PERM) uint64 ~ 64 MB
+HASH_CHUNK = 65536
+
+
+def optimal_bands(threshold, num_perm):
+    """
+    Chọn (bands, rows) với bands * rows <= num_perm sao cho tổng xác suất false positive
+    (Jaccard < threshold mà vẫn chung bucket) và false negative là nhỏ nhất.
+    """
+    best = None
+    s = np.linspace(0, 1, 1001)
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        p = 1 - (1 - s ** rows) ** bands
+        false_positive = p[s < threshold].mean() * threshold
+        false_negative = (1 - p[s >= threshold]).mean() * (1 - threshold)
+        error = false_positive + false_negative
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+def shingle_hashes(text):
+    """Hash 32-bit (crc32, ổn định giữa các process) của các shingle từ trong text."""
+    words = WORD_PATTERN.findall(text.lower())
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+    if len(words) <= SHINGLE_SIZE:
+        shingles = [" ".join(words)]
+    else:
+        shingles = [" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)]
+    return np.unique(np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles),
+                                 dtype=np.uint64, count=len(shingles)))
+
+
+class MinHasher:
+    """MinHash vector hóa theo batch: h_i(x) = ((a_i * x + b_i) mod p) & MAX_HASH, giống datasketch."""
+
+    def __init__(self, num_perm=NUM_PERM, seed=SEED):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+        self.num_perm = num_perm
+
+    def signatures(self, hash_sets):
+        """
+        Chữ ký (len(hash_sets) x num_perm) uint32 cho một batch tài liệu.
+        Các shingle của cả batch được nối lại và hoán vị cùng lúc, rồi lấy min theo từng
+        tài liệu bằng np.minimum.reduceat; tài liệu rỗng có chữ ký toàn MAX_HASH.
+        """
+        sigs = np.full((len(hash_sets), self.num_perm), MAX_HASH, dtype=np.uint64)
+        lengths = np.array([len(h) for h in hash_sets])
+        non_empty = np.flatnonzero(lengths)
+        if len(non_empty) == 0:
+            return sigs.astype(np.uint32)
+        values = np.concatenate([hash_sets[i] for i in non_empty])
+        # Chia theo tài liệu nguyên vẹn để reduceat không cắt ngang một tài liệu
+        starts = np.concatenate(([0], np.cumsum(lengths[non_empty])[:-1]))
+        chunk_start = 0
+        while chunk_start < len(non_empty):
+            chunk_end = chunk_start + 1
+            while (chunk_end < len(non_empty)
+                   and starts[chunk_end] - starts[chunk_start] + lengths[non_empty[chunk_end]] <= HASH_CHUNK):
+                chunk_end += 1
+            lo = starts[chunk_start]
+            hi = starts[chunk_end] if chunk_end < len(non_empty) else len(values)
+            # Nhân uint64 bị tràn có chủ đích (như datasketch), sau đó mod p và cắt về 32 bit
+            permuted = ((values[lo:hi, None] * self.a + self.b) % MERSENNE_PRIME) & MAX_HASH
+            docs = non_empty[chunk_start:chunk_end]
+            sigs[docs] = np.minimum.reduceat(permuted, starts[chunk_start:chunk_end] - lo, axis=0)
+            chunk_start = chunk_end
+        return sigs.astype(np.uint32)
+
+
+def band_hashes(sigs, bands, rows):
+    """Hash mỗi band (rows giá trị liên tiếp của chữ ký) thành số nguyên 63 bit để làm khóa bucket."""
+    banded = sigs[:, :bands * rows].astype(np.uint64).reshape(len(sigs), bands, rows)
+    h = np.full((len(sigs), bands), np.uint64(1469598103934665603), dtype=np.uint64)
+    for r in range(rows):
+        # FNV-1a trên từng giá trị 32 bit
+        h = (h ^ banded[:, :, r]) * np.uint64(1099511628211)
+    return (h & np.uint64((1 << 63) - 1)).astype(np.int64)
+
+
+class DedupIndex:
+    """
+    Index LSH lưu trên đĩa (SQLite). Mỗi tài liệu được lưu chữ ký và `bands` khóa bucket;
+    tìm ứng viên là `bands` lần tra chỉ mục (band, hash) nên chi phí mỗi tài liệu
+    không phụ thuộc số tài liệu đã thấy. Ứng viên được kiểm tra lại bằng độ tương đồng
+    ước lượng từ chữ ký, các cặp đạt LSH_THRESHOLD được lưu vào bảng matches.
+    """
+
+    def __init__(self, path=DEDUP_DB, num_perm=NUM_PERM, lsh_threshold=LSH_THRESHOLD):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.hasher = MinHasher(num_perm)
+        self.bands, self.rows = optimal_bands(lsh_threshold, num_perm)
+        self.lsh_threshold = lsh_threshold
+        self._create_schema()
+        self._check_params()
+
+    def _create_schema(self):
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS documents (
+                doc_id    INTEGER PRIMARY KEY,
+                record_id TEXT UNIQUE,
+                uri       TEXT,
+                source    TEXT,
+                signature BLOB
+            );
+            CREATE TABLE IF NOT EXISTS bands (
+                band   INTEGER,
+                hash   INTEGER,
+                doc_id INTEGER,
+                PRIMARY KEY (band, hash, doc_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS matches (
+                doc_id     INTEGER,
+                match_id   INTEGER,
+                similarity REAL,
+                PRIMARY KEY (doc_id, match_id)
+            ) WITHOUT ROWID;
+        """)
+
+    def _check_params(self):
+        """Index chỉ dùng được với đúng tham số đã tạo ra nó (seed, số hoán vị, banding, shingle)."""
+        params = {"num_perm": self.hasher.num_perm, "seed": SEED, "bands": self.bands,
+                  "rows": self.rows, "shingle_size": SHINGLE_SIZE, "lsh_threshold": self.lsh_threshold}
+        stored = dict(self.conn.execute("SELECT key, value FROM meta"))
+        if not stored:
+            self.conn.executemany("INSERT INTO meta VALUES (?, ?)", [(k, str(v)) for k, v in params.items()])
+            self.conn.commit()
+            return
+        mismatched = {k: (stored.get(k), str(v)) for k, v in params.items() if stored.get(k) != str(v)}
+        if mismatched:
+            raise ValueError(f"Tham số index {self.path} khác cấu hình hiện tại: {mismatched}. "
+                             f"Xóa file index để tạo lại.")
+
+    def close(self):
+        self.conn.close()
+
+    def _known_record_ids(self, record_ids):
+        known = set()
+        for i in range(0, len(record_ids), 500):
+            chunk = record_ids[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            known.update(r[0] for r in self.conn.execute(
+                f"SELECT record_id FROM documents WHERE record_id IN ({placeholders})", chunk))
+        return known
+
+    def _signatures_of(self, doc_ids):
+        sigs = {}
+        doc_ids = list(doc_ids)
+        for i in range(0, len(doc_ids), 500):
+            chunk = doc_ids[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for doc_id, blob in self.conn.execute(
+                    f"SELECT doc_id, signature FROM documents WHERE doc_id IN ({placeholders})", chunk):
+                sigs[doc_id] = np.frombuffer(blob, dtype=np.uint32)
+        return sigs
+
+    def add_batch(self, records):
+        """
+        Thêm một batch record (dict có record_id, uri, text, source) vào index.
+        Record đã có trong index (cùng record_id, ví dụ chạy lại cùng file) và record
+        không có chữ nào được bỏ qua. Trả về (số tài liệu mới, số cặp trùng lặp mới).
+        """
+        known = self._known_record_ids([r["record_id"] for r in records])
+        hashed = [(r, shingle_hashes(r["text"])) for r in records if r["record_id"] not in known]
+        hashed = [(r, h) for r, h in hashed if len(h)]
+        if not hashed:
+            return 0, 0
+        records = [r for r, _ in hashed]
+        sigs = self.hasher.signatures([h for _, h in hashed])
+        keys = band_hashes(sigs, self.bands, self.rows)
+
+        # Ứng viên trong index: nạp khóa bucket của batch vào bảng tạm rồi join một lần
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS batch_bands (pos INTEGER, band INTEGER, hash INTEGER)")
+        self.conn.execute("DELETE FROM batch_bands")
+        self.conn.executemany("INSERT INTO batch_bands VALUES (?, ?, ?)", (
+            (pos, band, int(keys[pos, band])) for pos in range(len(records)) for band in range(self.bands)
+        ))
+        candidates = {}
+        for pos, doc_id in self.conn.execute("""
+                SELECT DISTINCT bb.pos, b.doc_id
+                FROM batch_bands bb JOIN bands b ON b.band = bb.band AND b.hash = bb.hash"""):
+            candidates.setdefault(pos, set()).add(doc_id)
+        stored_sigs = self._signatures_of(set().union(*candidates.values()) if candidates else set())
+
+        # Ứng viên trong chính batch: tài liệu trước đó có chung bucket
+        seen_in_batch = {}
+        batch_doc_ids = []
+        pairs = []
+        with self.conn:
+            for pos, record in enumerate(records):
+                cur = self.conn.execute(
+                    "INSERT INTO documents (record_id, uri, source, signature) VALUES (?, ?, ?, ?)",
+                    (record["record_id"], record.get("uri"), record.get("source"), sigs[pos].tobytes()))
+                doc_id = cur.lastrowid
+                batch_doc_ids.append(doc_id)
+
+                batch_candidates = set()
+                for band in range(self.bands):
+                    bucket = seen_in_batch.setdefault((band, int(keys[pos, band])), [])
+                    batch_candidates.update(bucket)
+                    bucket.append(pos)
+                matched = [(match_id, stored_sigs[match_id]) for match_id in candidates.get(pos, ())]
+                matched += [(batch_doc_ids[p], sigs[p]) for p in batch_candidates]
+                if matched:
+                    other = np.stack([s for _, s in matched])
+                    similarity = (other == sigs[pos]).mean(axis=1)
+                    pairs += [(doc_id, match_id, float(sim))
+                              for (match_id, _), sim in zip(matched, similarity) if sim >= self.lsh_threshold]
+            self.conn.executemany("INSERT OR IGNORE INTO bands VALUES (?, ?, ?)", (
+                (band, int(keys[pos, band]), batch_doc_ids[pos])
+                for pos in range(len(records)) for band in range(self.bands)
+            ))
+            self.conn.executemany("INSERT OR REPLACE INTO matches VALUES (?, ?, ?)", pairs)
+        return len(records), len(pairs)
+
+    def add_records(self, records, batch_size=BATCH_SIZE):
+        """Thêm các record từ một iterator theo batch; trả về (số tài liệu mới, số cặp trùng lặp mới)."""
+        added = matched = 0
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                n, m = self.add_batch(batch)
+                added, matched = added + n, matched + m
+                print(f"Đã index {added} tài liệu mới, {matched} cặp gần trùng lặp")
+                batch = []
+        if batch:
+            n, m = self.add_batch(batch)
+            added, matched = added + n, matched + m
+        return added, matched
+
+    def duplicate_clusters(self, threshold=REPORT_THRESHOLD):
+        """
+        Cụm tài liệu gần trùng lặp: union-find trên các cặp có độ tương đồng >= threshold
+        (threshold < LSH_THRESHOLD không chính xác vì các cặp đó không được lưu).
+        Trả về list cụm (list doc_id), cụm lớn nhất trước.
+        """
+        if threshold < self.lsh_threshold:
+            print(f"Cảnh báo: threshold {threshold} < LSH_THRESHOLD {self.lsh_threshold}, "
+                  f"cụm có thể thiếu cặp.")
+        parent = {}
+
+        def find(x):
+            parent.setdefault(x, x)
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        for doc_id, match_id in self.conn.execute(
+                "SELECT doc_id, match_id FROM matches WHERE similarity >= ?", (threshold,)):
+            root_a, root_b = find(doc_id), find(match_id)
+            if root_a != root_b:
+                parent[max(root_a, root_b)] = min(root_a, root_b)
+        clusters = {}
+        for doc_id in parent:
+            clusters.setdefault(find(doc_id), []).append(doc_id)
+        return sorted((sorted(c) for c in clusters.values()), key=len, reverse=True)
+
+    def describe(self, doc_ids):
+        """(doc_id, uri, source) của các tài liệu, theo thứ tự doc_ids."""
+        placeholders = ",".join("?" * len(doc_ids))
+        rows = {r[0]: r for r in self.conn.execute(
+            f"SELECT doc_id, uri, source FROM documents WHERE doc_id IN ({placeholders})", doc_ids)}
+        return [rows[d] for d in doc_ids]
+
+    def document_count(self):
+        return self.conn.execute("SELECT count(*) FROM documents").fetchone()[0]
+
+
+def report_clusters(index, threshold=REPORT_THRESHOLD, top=10, examples=3):
+    clusters = index.duplicate_clusters(threshold)
+    duplicates = sum(len(c) - 1 for c in clusters)
+    print(f"{len(clusters)} cụm gần trùng lặp (Jaccard >= {threshold}), {duplicates} tài liệu thừa "
+          f"trên tổng {index.document_count()} tài liệu trong index")
+    for cluster in clusters[:top]:
+        print(f"- Cụm {cluster[0]}: {len(cluster)} tài liệu")
+        for doc_id, uri, source in index.describe(cluster[:examples]):
+            print(f"    {doc_id}  {uri}  ({source})")
+    return clusters
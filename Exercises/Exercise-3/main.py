@@ -1,9 +1,14 @@
 import requests
 import gzip
 import io
+import os
+
+from dedup import DedupIndex, REPORT_THRESHOLD, report_clusters
 
 BASE_URL = "https://data.commoncrawl.org/"
 WET_PATHS_GZ = "crawl-data/CC-MAIN-2022-05/wet.paths.gz"
+# Giới hạn số record đọc từ file WET (mặc định đọc hết), ví dụ 5000 khi chạy thử
+WET_MAX_RECORDS = int(os.getenv("WET_MAX_RECORDS", "0")) or None
 
 def download_gz_file(url):
     print(f"Downloading gzipped file: {url}")
@@ -18,27 +23,66 @@ def extract_first_path(gz_bytes):
         print(f"Found first WET file path: {first_line}")
         return first_line
 
-def stream_wet_file_lines(wet_url):
-    print(f"Streaming WET file from: {wet_url}")
+def read_warc_headers(stream):
+    # Đọc block header WARC đến dòng trống; None khi hết file
+    line = stream.readline()
+    while line in (b"\r\n", b"\n"):
+        line = stream.readline()
+    if not line:
+        return None
+    headers = {"WARC-Version": line.decode("utf-8").strip()}
+    for line in iter(stream.readline, b""):
+        line = line.decode("utf-8", errors="replace").strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip()] = value.strip()
+    return headers
+
+def stream_wet_records(wet_url, max_records=None):
+    """
+    Stream các record "conversion" (text đã trích từ trang web) của file .warc.wet.gz.
+    File là nhiều gzip member nối nhau, GzipFile giải nén liên tục; nội dung mỗi record
+    được đọc đúng Content-Length byte nên text chứa dòng "WARC/1.0" không làm lệch record.
+    """
+    print(f"Streaming WET records from: {wet_url}")
     response = requests.get(wet_url, stream=True)
     response.raise_for_status()
+    source = wet_url.rsplit("/", 1)[-1]
+    count = 0
+    with gzip.GzipFile(fileobj=response.raw) as stream:
+        while max_records is None or count < max_records:
+            headers = read_warc_headers(stream)
+            if headers is None:
+                break
+            content = stream.read(int(headers.get("Content-Length", 0)))
+            if headers.get("WARC-Type") != "conversion":
+                continue
+            count += 1
+            yield {
+                "record_id": headers.get("WARC-Record-ID"),
+                "uri": headers.get("WARC-Target-URI"),
+                "source": source,
+                "text": content.decode("utf-8", errors="replace"),
+            }
 
-    for line in response.iter_lines():
-        try:
-            yield line.decode('utf-8')
-        except UnicodeDecodeError:
-            # Bỏ qua dòng không thể giải mã
-            continue
 def main():
      gz_bytes = download_gz_file(BASE_URL + WET_PATHS_GZ)
 
     # Bước 2: Giải nén và lấy dòng đầu tiên
      first_path = extract_first_path(gz_bytes)
 
-    # Bước 3: Tạo URL hoàn chỉnh và stream dòng
+    # Bước 3: Tạo URL hoàn chỉnh và stream từng record
      full_url = BASE_URL + first_path
-     for line in stream_wet_file_lines(full_url):
-        print(line)
+
+    # Bước 4: Dedup: MinHash LSH, so với mọi tài liệu đã thấy ở các file/lần chạy trước
+     index = DedupIndex()
+     try:
+         added, matched = index.add_records(stream_wet_records(full_url, WET_MAX_RECORDS))
+         print(f"Đã thêm {added} tài liệu mới vào index, {matched} cặp gần trùng lặp")
+         report_clusters(index, REPORT_THRESHOLD)
+     finally:
+         index.close()
 
 
 if __name__ == "__main__":
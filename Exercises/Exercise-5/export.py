@@ -0,0 +1,292 @@
+import argparse
+import logging
+import math
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import psycopg2
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+# Dùng lại cấu hình kết nối (DB_HOST, DB_PORT, ...) và logging của main.py
+from main import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+# --- Hằng số và Đường dẫn ---
+EXPORT_DIR = Path("export")
+# Số dòng mỗi lần fetch từ server-side cursor, cũng là kích thước mỗi record batch Parquet
+DEFAULT_BATCH_SIZE = 50_000
+# Cột partition (hive: transaction_day=YYYY-MM-DD) của các bảng có ngày giao dịch
+PARTITION_COLUMN = "transaction_day"
+
+# --- Định nghĩa bảng export ---
+# query có placeholder {where} cho điều kiện chia khoảng; schema là kiểu Parquet đầu ra
+# (khớp schema.sql). source/pk/date_column dùng để chia khoảng khi export song song.
+TRANSACTION_FIELDS = [
+    ("transaction_id", pa.string()),
+    ("transaction_date", pa.timestamp("us")),
+    ("product_id", pa.int32()),
+    ("product_code", pa.string()),
+    ("product_description", pa.string()),
+    ("quantity", pa.int32()),
+    ("account_id", pa.int32()),
+]
+
+EXPORT_TABLES: Dict[str, Dict] = {
+    "accounts": {
+        "query": """
+            SELECT customer_id, first_name, last_name, address_1, address_2,
+                   city, state, zip_code, join_date
+            FROM accounts WHERE {where}
+        """,
+        "source": "accounts",
+        "pk": "customer_id",
+        "date_column": None,
+        "schema": pa.schema([
+            ("customer_id", pa.int32()),
+            ("first_name", pa.string()),
+            ("last_name", pa.string()),
+            ("address_1", pa.string()),
+            ("address_2", pa.string()),
+            ("city", pa.string()),
+            ("state", pa.string()),
+            ("zip_code", pa.string()),
+            ("join_date", pa.date32()),
+        ]),
+    },
+    "products": {
+        "query": """
+            SELECT product_id, product_code, product_description
+            FROM products WHERE {where}
+        """,
+        "source": "products",
+        "pk": "product_id",
+        "date_column": None,
+        "schema": pa.schema([
+            ("product_id", pa.int32()),
+            ("product_code", pa.string()),
+            ("product_description", pa.string()),
+        ]),
+    },
+    "transactions": {
+        # ORDER BY ngày: các partition liền nhau nên writer chỉ giữ ít file mở cùng lúc
+        "query": """
+            SELECT t.transaction_id, t.transaction_date, t.product_id, t.product_code,
+                   t.product_description, t.quantity, t.account_id,
+                   t.transaction_date::date AS transaction_day
+            FROM transactions t WHERE {where}
+            ORDER BY t.transaction_date
+        """,
+        "source": "transactions t",
+        "pk": "t.transaction_id",
+        "date_column": "t.transaction_date",
+        "schema": pa.schema(TRANSACTION_FIELDS + [(PARTITION_COLUMN, pa.date32())]),
+    },
+    # View đã join sẵn cho Spark: giao dịch + thông tin khách hàng + sản phẩm trong danh mục
+    "transactions_joined": {
+        "query": """
+            SELECT t.transaction_id, t.transaction_date, t.product_id, t.product_code,
+                   t.product_description, t.quantity, t.account_id,
+                   a.first_name, a.last_name, a.city, a.state, a.zip_code, a.join_date,
+                   p.product_code AS catalog_product_code,
+                   p.product_description AS catalog_product_description,
+                   t.transaction_date::date AS transaction_day
+            FROM transactions t
+            LEFT JOIN accounts a ON a.customer_id = t.account_id
+            LEFT JOIN products p ON p.product_id = t.product_id
+            WHERE {where}
+            ORDER BY t.transaction_date
+        """,
+        "source": "transactions t",
+        "pk": "t.transaction_id",
+        "date_column": "t.transaction_date",
+        "schema": pa.schema(TRANSACTION_FIELDS + [
+            ("first_name", pa.string()),
+            ("last_name", pa.string()),
+            ("city", pa.string()),
+            ("state", pa.string()),
+            ("zip_code", pa.string()),
+            ("join_date", pa.date32()),
+            ("catalog_product_code", pa.string()),
+            ("catalog_product_description", pa.string()),
+            (PARTITION_COLUMN, pa.date32()),
+        ]),
+    },
+}
+
+# Một khoảng export: (điều kiện SQL, tham số)
+Range = Tuple[str, Tuple]
+
+
+# --- Chia khoảng cho export song song ---
+
+def date_ranges(conn: psycopg2.extensions.connection, table: str, parts: int) -> List[Range]:
+    """Chia [min, max] của ngày giao dịch thành `parts` khoảng ngày liền nhau (+ 1 khoảng cho NULL)."""
+    spec = EXPORT_TABLES[table]
+    date_column = spec["date_column"]
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT min({date_column})::date, max({date_column})::date FROM {spec['source']}")
+        first_day, last_day = cur.fetchone()
+    ranges: List[Range] = [(f"{date_column} IS NULL", ())]
+    if first_day is None:
+        return ranges
+    days = (last_day - first_day).days + 1
+    step = math.ceil(days / parts)
+    for i in range(0, days, step):
+        lower = first_day + timedelta(days=i)
+        upper = first_day + timedelta(days=min(i + step, days))
+        ranges.append((f"{date_column} >= %s AND {date_column} < %s", (lower, upper)))
+    return ranges
+
+def pk_ranges(conn: psycopg2.extensions.connection, table: str, parts: int) -> List[Range]:
+    """
+    Chia theo khóa chính thành `parts` khoảng có số dòng xấp xỉ nhau, biên lấy bằng
+    percentile_disc nên dùng được cho cả khóa số lẫn khóa chuỗi (transaction_id).
+    """
+    spec = EXPORT_TABLES[table]
+    pk = spec["pk"]
+    if parts <= 1:
+        return [("TRUE", ())]
+    fractions = [i / parts for i in range(1, parts)]
+    with conn.cursor() as cur:
+        cur.execute(
+            f"SELECT percentile_disc(%s::float8[]) WITHIN GROUP (ORDER BY {pk}) "
+            f"FROM {spec['source']}",
+            (fractions,),
+        )
+        bounds = sorted(set(b for b in (cur.fetchone()[0] or []) if b is not None))
+    if not bounds:
+        return [("TRUE", ())]
+    ranges: List[Range] = [(f"{pk} < %s", (bounds[0],))]
+    ranges += [(f"{pk} >= %s AND {pk} < %s", (lo, hi)) for lo, hi in zip(bounds, bounds[1:])]
+    ranges.append((f"{pk} >= %s", (bounds[-1],)))
+    return ranges
+
+
+# --- Export ---
+
+def fetch_batches(cur, schema: pa.Schema, batch_size: int) -> Iterator[pa.RecordBatch]:
+    """Đọc từ server-side cursor từng lô batch_size dòng và chuyển thành RecordBatch đúng kiểu."""
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            return
+        columns = list(zip(*rows))
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+            schema=schema,
+        )
+
+def export_range(table: str, where: str, params: Tuple, part: int, output_dir: Path,
+                 batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """
+    Export một khoảng của bảng qua named (server-side) cursor trên kết nối riêng:
+    Postgres chỉ gửi itersize dòng mỗi lần nên bộ nhớ bị chặn bởi batch_size.
+    Chạy được trong process con (export song song). Trả về số dòng đã ghi.
+    File part-{part:03d}-* cũ của khoảng này (mọi partition) bị xóa trước khi ghi,
+    nên gọi trực tiếp trên thư mục đã có bản export trước vẫn không đọc phải dữ liệu cũ.
+    """
+    spec = EXPORT_TABLES[table]
+    schema = spec["schema"]
+    basename_prefix = f"part-{part:03d}-"
+    for old_file in (output_dir / table).rglob(f"{basename_prefix}*.parquet"):
+        old_file.unlink()
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError("Không thể kết nối đến database.")
+    rows = 0
+    try:
+        conn.set_session(readonly=True)
+        with conn.cursor(name=f"export_{table}_{part}") as cur:
+            cur.itersize = batch_size
+            cur.execute(spec["query"].format(where=where), params)
+
+            def counted() -> Iterator[pa.RecordBatch]:
+                nonlocal rows
+                for batch in fetch_batches(cur, schema, batch_size):
+                    rows += batch.num_rows
+                    yield batch
+
+            partitioned = PARTITION_COLUMN in schema.names
+            ds.write_dataset(
+                counted(),
+                output_dir / table,
+                schema=schema,
+                format="parquet",
+                partitioning=ds.partitioning(pa.schema([schema.field(PARTITION_COLUMN)]), flavor="hive")
+                if partitioned else None,
+                # Mỗi khoảng có tên file riêng: các process không ghi đè lẫn nhau
+                basename_template=f"{basename_prefix}{{i}}.parquet",
+                existing_data_behavior="overwrite_or_ignore",
+                max_rows_per_group=batch_size,
+            )
+        conn.commit()
+    finally:
+        conn.close()
+    return rows
+
+def export_table(table: str, output_dir: Path = EXPORT_DIR, workers: int = 1,
+                 split_by: str = "date", batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """Export một bảng/view, song song trên `workers` kết nối nếu workers > 1."""
+    spec = EXPORT_TABLES[table]
+    target = output_dir / table
+    # Xóa bản export cũ: mỗi lần chạy là một snapshot đầy đủ
+    if target.exists():
+        shutil.rmtree(target)
+    target.mkdir(parents=True)
+
+    ranges: List[Range] = [("TRUE", ())]
+    if workers > 1:
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError("Không thể kết nối đến database.")
+        try:
+            if split_by == "date" and spec["date_column"]:
+                ranges = date_ranges(conn, table, workers)
+            else:
+                ranges = pk_ranges(conn, table, workers)
+        finally:
+            conn.close()
+
+    start = time.perf_counter()
+    if workers > 1 and len(ranges) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(export_range, table, where, params, part, output_dir, batch_size)
+                for part, (where, params) in enumerate(ranges)
+            ]
+            rows = sum(f.result() for f in futures)
+    else:
+        rows = sum(export_range(table, where, params, part, output_dir, batch_size)
+                   for part, (where, params) in enumerate(ranges))
+    logger.info(f"Đã export {rows} dòng {table} -> {target} ({len(ranges)} khoảng, "
+                f"{time.perf_counter() - start:.2f}s)")
+    return rows
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Export bảng Exercise-5 từ Postgres ra Parquet.")
+    parser.add_argument("--tables", nargs="+", default=list(EXPORT_TABLES), choices=list(EXPORT_TABLES))
+    parser.add_argument("--output-dir", type=Path, default=EXPORT_DIR)
+    parser.add_argument("--workers", type=int, default=1, help="Số kết nối/process export song song")
+    parser.add_argument("--split-by", choices=["date", "pk"], default="date",
+                        help="Chia khoảng theo transaction_date hay khóa chính (bảng không có ngày luôn dùng pk)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logger.info("--- Bắt đầu export Exercise 5: Postgres -> Parquet ---")
+    try:
+        for table_name in args.tables:
+            export_table(table_name, args.output_dir, args.workers, args.split_by, args.batch_size)
+    except Exception as e:
+        logger.error(f"Export thất bại: {e}", exc_info=True)
+        exit(1)
+    logger.info("--- Kết thúc export ---")
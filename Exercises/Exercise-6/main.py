@@ -1,4 +1,5 @@
 import logging
+import sys
 from pathlib import Path
 from pyspark.sql import SparkSession, DataFrame, Row
 from pyspark.sql import functions as F
@@ -11,6 +12,11 @@ import io
 import csv
 from glob import glob # Để tìm file zip
 
+# Module dùng chung giữa các exercise (Exercises/shared, mount vào /shared trong docker)
+sys.path.append(str(Path(__file__).resolve().parent.parent / "shared"))
+from spark_session import create_spark_session as create_tuned_spark_session  # noqa: E402
+from spark_profiler import SparkProfiler  # noqa: E402
+
 # --- Cấu hình Logging ---
 logging.basicConfig(
     level=logging.INFO,
@@ -27,16 +33,13 @@ INPUT_FILES_PATTERN = "data/*.zip"
 
 # --- Khởi tạo SparkSession ---
 def create_spark_session(app_name="Exercise6"):
-    """Khởi tạo và trả về một SparkSession."""
-    logger.info(f"Đang khởi tạo SparkSession: {app_name}")
+    """Khởi tạo và trả về một SparkSession (profile theo SPARK_PROFILE, xem shared/spark_session.py)."""
     try:
-        spark = SparkSession.builder \
-            .appName(app_name) \
-            .master("local[*]") \
-            .config("spark.driver.memory", "2g") \
-            .config("spark.sql.legacy.timeParserPolicy", "LEGACY") \
-            .getOrCreate()
-        logger.info("SparkSession đã được tạo thành công.")
+        spark = create_tuned_spark_session(
+            app_name,
+            input_paths=[INPUT_FILES_PATTERN],
+            extra_conf={"spark.sql.legacy.timeParserPolicy": "LEGACY"},
+        )
         # Đặt cấu hình để xử lý timestamp đúng định dạng khi cast từ string
         spark.conf.set("spark.sql.datetime.java8API.enabled", "true") # Cần thiết cho một số xử lý date/time
         return spark
@@ -378,10 +381,13 @@ if __name__ == "__main__":
     logger.info("--- Bắt đầu Exercise 6: PySpark Aggregation ---")
 
     spark = None
+    profiler = None # Đo thời gian/metric Spark của từng bước
     trips_df_cached = None # Để theo dõi DataFrame đã cache/persist
     try:
         spark = create_spark_session()
-        trips_df = read_data(spark, INPUT_FILES_PATTERN, schema)
+        profiler = SparkProfiler(spark, "exercise6")
+        with profiler.step("read_data"):
+            trips_df = read_data(spark, INPUT_FILES_PATTERN, schema)
 
         if trips_df:
             # Cache DataFrame gốc sau khi đọc và kiểm tra schema thành công
@@ -393,25 +399,31 @@ if __name__ == "__main__":
             # Tạo thư mục reports nếu chưa có
             REPORTS_DIR.mkdir(parents=True, exist_ok=True)
 
-            # Thực hiện các phép tính và lưu báo cáo
-            report1 = calculate_average_duration_per_day(trips_df_cached)
-            save_report(report1, "average_duration_per_day")
+            # Thực hiện các phép tính và lưu báo cáo (mỗi báo cáo là một bước được đo)
+            with profiler.step("average_duration_per_day"):
+                report1 = calculate_average_duration_per_day(trips_df_cached)
+                save_report(report1, "average_duration_per_day")
 
-            report2 = count_trips_per_day(trips_df_cached)
-            save_report(report2, "trips_per_day")
+            with profiler.step("trips_per_day"):
+                report2 = count_trips_per_day(trips_df_cached)
+                save_report(report2, "trips_per_day")
 
-            report3 = most_popular_start_station_per_month(trips_df_cached)
-            save_report(report3, "most_popular_start_station_per_month")
+            with profiler.step("most_popular_start_station_per_month"):
+                report3 = most_popular_start_station_per_month(trips_df_cached)
+                save_report(report3, "most_popular_start_station_per_month")
 
-            report4 = top_3_stations_last_two_weeks(trips_df_cached)
-            save_report(report4, "top_3_stations_last_two_weeks")
+            with profiler.step("top_3_stations_last_two_weeks"):
+                report4 = top_3_stations_last_two_weeks(trips_df_cached)
+                save_report(report4, "top_3_stations_last_two_weeks")
 
-            report5 = average_duration_by_gender(trips_df_cached)
-            save_report(report5, "average_duration_by_gender")
+            with profiler.step("average_duration_by_gender"):
+                report5 = average_duration_by_gender(trips_df_cached)
+                save_report(report5, "average_duration_by_gender")
 
-            report6_longest, report6_shortest = top_10_ages_longest_shortest_trips(trips_df_cached)
-            save_report(report6_longest, "top_10_ages_longest_trips")
-            save_report(report6_shortest, "top_10_ages_shortest_trips")
+            with profiler.step("top_10_ages_longest_shortest_trips"):
+                report6_longest, report6_shortest = top_10_ages_longest_shortest_trips(trips_df_cached)
+                save_report(report6_longest, "top_10_ages_longest_trips")
+                save_report(report6_shortest, "top_10_ages_shortest_trips")
 
         else:
             logger.error("Không thể đọc hoặc xử lý dữ liệu đầu vào. Dừng xử lý.")
@@ -425,6 +437,8 @@ if __name__ == "__main__":
             logger.info("Đang unpersist DataFrame chính...")
             trips_df_cached.unpersist()
             logger.info("DataFrame chính đã được unpersist.")
+        if profiler and profiler.steps:
+            profiler.write_report()
         if spark:
             logger.info("Đang dừng SparkSession...")
             spark.stop()
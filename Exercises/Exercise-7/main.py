@@ -2,15 +2,25 @@ import logging
 import zipfile
 import io
 import csv
+import json
+import os
+import re
+import sys
+from datetime import date, datetime, timedelta
+from itertools import chain
 from pathlib import Path
-from typing import Optional, List
+from typing import Optional, List, Dict, Tuple, Set
 
-from pyspark.sql import SparkSession, DataFrame
+from pyspark.sql import SparkSession, DataFrame, Column, Window
 from pyspark.sql import functions as F
 from pyspark.sql.types import (
-    StringType, LongType, IntegerType, DateType
+    DataType, StringType, LongType, IntegerType, DateType
 )
-from pyspark.sql.window import Window
+
+# Module dùng chung giữa các exercise (Exercises/shared, mount vào /shared trong docker)
+sys.path.append(str(Path(__file__).resolve().parent.parent / "shared"))
+from spark_session import create_spark_session as create_tuned_spark_session  # noqa: E402
+from spark_profiler import SparkProfiler, profile_step  # noqa: E402
 
 # --- Cấu hình Logging ---
 logging.basicConfig(
@@ -23,24 +33,53 @@ logger = logging.getLogger(__name__)
 # --- Hằng số và Đường dẫn ---
 # <<< SỬA LẠI ĐỂ TRỎ ĐÚNG FILE ZIP >>>
 INPUT_ZIP_FILE = Path("data") / "hard-drive-2022-01-01-failures.csv.zip"
+INPUT_DIR = Path("data")
+# Backblaze công bố 1 file mỗi ngày, tên file chứa ngày dạng YYYY-MM-DD
+INPUT_ZIP_GLOB = "*.zip"
+FILE_DATE_PATTERN = r"(\d{4}-\d{2}-\d{2})"
+# Bảng Parquet đầu ra (chế độ incremental), partition theo file_date
+OUTPUT_TABLE_DIR = Path("output") / "drive_stats"
+# Chế độ chạy: "single" (1 file INPUT_ZIP_FILE, hiển thị kết quả) hoặc "incremental"
+PIPELINE_MODE = os.getenv("EX7_MODE", "single")
+# Danh sách ngày cần xử lý lại dù đã có partition, ví dụ "2022-01-01,2022-01-02"
+REPROCESS_DATES = os.getenv("EX7_REPROCESS_DATES", "")
+# Lịch sử theo ổ đĩa (chế độ incremental): bảng hẹp partition theo file_date,
+# bucket + sort theo serial_number để window theo serial_number không cần shuffle
+HISTORY_TABLE = "drive_history"
+HISTORY_TABLE_DIR = Path("output") / "drive_history"
+# Số bucket cố định khi bảng đã có dữ liệu: đổi giá trị phải xóa HISTORY_TABLE_DIR để ghi lại
+HISTORY_BUCKETS = 16
+# Đặc trưng rolling theo ổ đĩa, partition theo file_date
+FEATURES_TABLE_DIR = Path("output") / "drive_features"
+# Cột SMART cần đặc trưng và các cửa sổ (ngày): delta = giá trị hôm nay - giá trị sớm nhất trong cửa sổ
+SMART_FEATURE_COLUMNS = ["smart_5_raw", "smart_187_raw"]
+FEATURE_WINDOWS_DAYS = [7, 30]
+# Tập capacity_bytes toàn cục (mọi ngày đã gặp) dùng để xếp hạng, lưu giữa các lần chạy
+RANKING_CACHE_FILE = Path("cache") / "storage_ranking.json"
+# Phương thức tạo primary_key (EX7_PK_METHOD): "sha256" (mặc định), "xxhash128" hoặc "xxhash64".
+# Mặc định giữ khóa chuỗi hex như output cũ; xxhash64 cho khóa LongType nên chỉ dùng cho
+# bảng đầu ra mới (không trộn với partition đã ghi bằng khóa chuỗi)
+PRIMARY_KEY_METHODS = ("sha256", "xxhash128", "xxhash64")
+PRIMARY_KEY_METHOD = os.getenv("EX7_PK_METHOD", "sha256").strip().lower()
+PRIMARY_KEY_SALT_128 = "ex7-pk-128"
+PRIMARY_KEY_COLUMNS = ["date", "serial_number", "model"]
 # Thư mục tạm không còn cần thiết nếu đọc trực tiếp
 # TEMP_EXTRACT_DIR = Path("/tmp/extracted_csv_ex7")
 
 # --- Khởi tạo SparkSession ---
 def create_spark_session(app_name="Exercise7"):
-    """Khởi tạo và trả về một SparkSession."""
-    logger.info(f"Đang khởi tạo SparkSession: {app_name}")
+    """Khởi tạo và trả về một SparkSession (profile theo SPARK_PROFILE, xem shared/spark_session.py)."""
     try:
-        spark = SparkSession.builder \
-            .appName(app_name) \
-            .master("local[*]") \
-            .config("spark.driver.memory", "2g") \
-            .config("spark.sql.legacy.timeParserPolicy", "LEGACY") \
-            .config("spark.sql.sources.parallelPartitionDiscovery.parallelism", "4") \
-            .getOrCreate()
+        spark = create_tuned_spark_session(
+            app_name,
+            input_paths=[INPUT_DIR / INPUT_ZIP_GLOB],
+            extra_conf={
+                "spark.sql.legacy.timeParserPolicy": "LEGACY",
+                "spark.sql.sources.parallelPartitionDiscovery.parallelism": "4",
+            },
+        )
         # Đặt cấu hình để xử lý timestamp/date đúng định dạng khi cast từ string
         spark.conf.set("spark.sql.datetime.java8API.enabled", "true")
-        logger.info("SparkSession đã được tạo thành công.")
         return spark
     except Exception as e:
         logger.error(f"Lỗi khi tạo SparkSession: {e}", exc_info=True)
@@ -122,30 +161,95 @@ def read_zipped_csv(spark: SparkSession, zip_file_path: Path) -> Optional[DataFr
         logger.error(f"Lỗi không mong muốn khi đọc file ZIP {zip_file_path}: {e}", exc_info=True)
         return None
 
+# --- Đặc tả kiểu dữ liệu cho bước cast ---
+# Khai báo tên cột cụ thể -> kiểu đích. Cột DateType được parse bằng DATE_FORMAT.
+CAST_SPEC: Dict[str, DataType] = {
+    "date": DateType(),
+    "capacity_bytes": LongType(),
+    "failure": IntegerType(),
+}
+# Quy tắc theo hậu tố, áp dụng cho các cột không có trong CAST_SPEC (các cột SMART)
+CAST_SUFFIX_RULES: List[Tuple[str, DataType]] = [
+    ("_raw", LongType()),
+    ("_normalized", IntegerType()),
+]
+DATE_FORMAT = "yyyy-MM-dd"
+
 # --- Hàm làm sạch và ép kiểu dữ liệu ---
-def cast_types(df: DataFrame) -> DataFrame:
-    """Ép kiểu các cột quan trọng về đúng định dạng."""
+def resolve_cast_plan(columns: List[str],
+                      spec: Optional[Dict[str, DataType]] = None,
+                      suffix_rules: Optional[List[Tuple[str, DataType]]] = None) -> Dict[str, DataType]:
+    """Xác định kiểu đích cho từng cột dựa trên đặc tả khai báo (tên cột trước, hậu tố sau)."""
+    spec = CAST_SPEC if spec is None else spec
+    suffix_rules = CAST_SUFFIX_RULES if suffix_rules is None else suffix_rules
+    plan = {}
+    for col_name in columns:
+        if col_name in spec:
+            plan[col_name] = spec[col_name]
+            continue
+        for suffix, target_type in suffix_rules:
+            if col_name.endswith(suffix):
+                plan[col_name] = target_type
+                break
+    return plan
+
+def _cast_expr(col_name: str, target_type: DataType) -> Column:
+    """Biểu thức cast cho một cột (chưa alias)."""
+    if isinstance(target_type, DateType):
+        return F.to_date(F.col(col_name), DATE_FORMAT)
+    return F.col(col_name).cast(target_type)
+
+def report_cast_failures(raw_df: DataFrame, plan: Dict[str, DataType]) -> Dict[str, int]:
+    """
+    Đếm số giá trị cast thất bại theo từng cột trong MỘT lần aggregate:
+    giá trị gốc khác NULL/rỗng nhưng kết quả cast là NULL.
+    """
+    if not plan:
+        return {}
+    failure_exprs = [
+        F.sum(
+            F.when(
+                F.col(col_name).isNotNull()
+                & (F.trim(F.col(col_name)) != "")
+                & _cast_expr(col_name, target_type).isNull(),
+                1
+            ).otherwise(0)
+        ).alias(col_name)
+        for col_name, target_type in plan.items()
+    ]
+    row = raw_df.agg(*failure_exprs).first()
+    failures = {col_name: row[col_name] for col_name in plan if row[col_name]}
+    if failures:
+        for col_name, count in failures.items():
+            logger.warning(f"Cast thất bại cho cột '{col_name}' ({plan[col_name].simpleString()}): {count} giá trị.")
+    else:
+        logger.info("Không có giá trị nào cast thất bại.")
+    return failures
+
+def cast_types(df: DataFrame,
+               spec: Optional[Dict[str, DataType]] = None,
+               suffix_rules: Optional[List[Tuple[str, DataType]]] = None,
+               check_failures: bool = True) -> DataFrame:
+    """
+    Ép kiểu các cột theo đặc tả khai báo bằng MỘT phép select duy nhất.
+    Tránh chuỗi hàng trăm withColumn làm Catalyst phân tích plan rất chậm.
+    """
     logger.info("Thực hiện cast kiểu dữ liệu...")
     try:
-        # Ép kiểu Date
-        df = df.withColumn("date", F.to_date(F.col("date"), "yyyy-MM-dd"))
-        logger.info("Đã cast cột 'date' sang DateType.")
-
-        # Ép kiểu số nguyên/dài
-        long_cols = ["capacity_bytes"] + [col for col in df.columns if col.startswith("smart_") and col.endswith("_raw")]
-        for col_name in long_cols:
-            if col_name in df.columns:
-                df = df.withColumn(col_name, F.col(col_name).cast(LongType()))
-                # logger.debug(f"Đã cast cột '{col_name}' sang LongType.") # Ghi log chi tiết nếu cần
-        logger.info(f"Đã cast các cột raw sang LongType: {long_cols}")
-
-        if "failure" in df.columns:
-             df = df.withColumn("failure", F.col("failure").cast(IntegerType()))
-             logger.info("Đã cast cột 'failure' sang IntegerType.")
-
-        # Các cột _normalized thường là string hoặc có thể null, giữ nguyên trừ khi có yêu cầu khác
+        plan = resolve_cast_plan(df.columns, spec, suffix_rules)
+        # Giữ nguyên thứ tự cột, cột không có trong plan được giữ nguyên kiểu
+        select_exprs = [
+            _cast_expr(col_name, plan[col_name]).alias(col_name) if col_name in plan else F.col(col_name)
+            for col_name in df.columns
+        ]
+        typed_df = df.select(*select_exprs)
+        logger.info(f"Đã tạo projection cast cho {len(plan)}/{len(df.columns)} cột.")
+
+        if check_failures:
+            report_cast_failures(df, plan)
+
         logger.info("Cast kiểu dữ liệu hoàn tất.")
-        return df
+        return typed_df
     except Exception as e:
         logger.error(f"Lỗi trong quá trình cast kiểu dữ liệu: {e}", exc_info=True)
         # Trả về DataFrame gốc nếu có lỗi để tránh lỗi tiếp theo
@@ -164,9 +268,8 @@ def add_file_date(df: DataFrame) -> DataFrame:
     logger.info("Câu 2: Thêm cột file_date...")
     # Trích xuất ngày dạng YYYY-MM-DD từ tên file
     # Pattern: Tìm chuỗi có dạng 4 số - 2 số - 2 số
-    date_pattern = r"(\d{4}-\d{2}-\d{2})"
     # regexp_extract trả về chuỗi khớp với group 1, hoặc chuỗi rỗng nếu không khớp
-    df = df.withColumn("file_date_str", F.regexp_extract(F.col("source_file"), date_pattern, 1))
+    df = df.withColumn("file_date_str", F.regexp_extract(F.col("source_file"), FILE_DATE_PATTERN, 1))
     # Chuyển chuỗi ngày sang kiểu Date, nếu chuỗi rỗng hoặc sai định dạng sẽ thành null
     return df.withColumn("file_date", F.to_date(F.col("file_date_str"), "yyyy-MM-dd"))
 
@@ -185,101 +288,472 @@ def add_brand(df: DataFrame) -> DataFrame:
          .otherwise(F.lit("unknown"))
     )
 
+def load_capacity_set(cache_file: Path = RANKING_CACHE_FILE) -> Set[int]:
+    """Tập capacity_bytes toàn cục đã lưu (rỗng nếu chưa có hoặc không đọc được)."""
+    if not cache_file.exists():
+        return set()
+    try:
+        cache = json.loads(cache_file.read_text(encoding="utf-8"))
+    except (OSError, ValueError) as e:
+        logger.warning(f"Không đọc được tập dung lượng {cache_file}, bắt đầu lại từ đầu: {e}")
+        return set()
+    return {int(cap) for cap in cache.get("capacities", [])}
+
+def load_capacity_ranks(capacities: List[int], cache_file: Path = RANKING_CACHE_FILE) -> Dict[int, int]:
+    """
+    Xếp hạng dense_rank (lớn nhất = 1) trên tập capacity_bytes toàn cục: hợp của tập đã lưu
+    với `capacities` của lần gọi này. Hạng của một dung lượng vì vậy giống nhau ở mọi
+    partition file_date, chỉ đổi khi xuất hiện dung lượng mới (tập được ghi lại khi đó).
+    """
+    known = load_capacity_set(cache_file)
+    distinct_caps = known | set(capacities)
+    if distinct_caps != known:
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            cache_file.write_text(json.dumps({"capacities": sorted(distinct_caps, reverse=True)}, indent=2),
+                                  encoding="utf-8")
+            logger.info(f"Tập dung lượng có {len(distinct_caps - known)} giá trị mới, đã lưu vào {cache_file}")
+        except OSError as e:
+            logger.warning(f"Không ghi được tập dung lượng {cache_file}: {e}")
+
+    # Các capacity được sắp giảm dần và duy nhất nên dense_rank chính là vị trí + 1
+    return {cap: idx + 1 for idx, cap in enumerate(sorted(distinct_caps, reverse=True))}
+
+def storage_ranking_expr(ranks: Dict[int, int]) -> Column:
+    """
+    Bảng xếp hạng dưới dạng map literal: được nhúng vào plan và gửi tới mọi executor
+    (tương đương broadcast), không cần join. capacity_bytes NULL hoặc không có trong map
+    cho storage_ranking NULL như left join trước đây.
+    """
+    if not ranks:
+        return F.lit(None).cast(IntegerType())
+    rank_map = F.create_map(*chain.from_iterable(
+        (F.lit(cap).cast(LongType()), F.lit(rank)) for cap, rank in ranks.items()
+    ))
+    return rank_map[F.col("capacity_bytes")]
+
 def add_storage_ranking(df: DataFrame) -> DataFrame:
     """Câu 4: Thêm cột storage_ranking dựa trên capacity_bytes."""
     logger.info("Câu 4: Thêm cột storage_ranking...")
-    # Tạo DataFrame phụ chứa các giá trị capacity_bytes duy nhất và xếp hạng chúng
+    # Tạo bảng phụ chứa các giá trị capacity_bytes duy nhất và xếp hạng chúng
     # Điều này phù hợp với mô tả "relates capacity_bytes to the model column"
     # và tạo "buckets"/"rankings" cho capacity.
+    # Chỉ có vài chục giá trị capacity khác nhau nên collect về driver là rẻ,
+    # tránh Window không partition (dồn toàn bộ dữ liệu về 1 partition) và shuffle join.
     logger.info("Tạo bảng xếp hạng dung lượng duy nhất...")
-    window_spec_rank = Window.orderBy(F.col("capacity_bytes").desc())
-    capacity_ranks_df = df.select("capacity_bytes") \
-                          .distinct() \
-                          .filter(F.col("capacity_bytes").isNotNull()) \
-                          .withColumn("storage_ranking", F.dense_rank().over(window_spec_rank))
-
-    # Log top vài hạng dung lượng để kiểm tra
-    logger.info("Top dung lượng và hạng:")
-    capacity_ranks_df.show(5, truncate=False)
-
-    # Join bảng xếp hạng này trở lại DataFrame chính
-    logger.info("Join bảng xếp hạng dung lượng vào DataFrame chính...")
-    # Sử dụng left join để giữ tất cả các dòng gốc, ngay cả khi capacity_bytes là null
-    df_joined = df.join(capacity_ranks_df, ["capacity_bytes"], "left")
-    return df_joined
-
-
-def add_primary_key(df: DataFrame, key_columns: List[str]) -> DataFrame:
+    capacities = [row["capacity_bytes"] for row in
+                  df.select("capacity_bytes")
+                    .filter(F.col("capacity_bytes").isNotNull())
+                    .distinct()
+                    .collect()]
+    ranks = load_capacity_ranks(capacities)
+
+    # Log top vài hạng dung lượng để kiểm tra (không cần chạy thêm job .show())
+    top_ranks = sorted(ranks.items(), key=lambda item: item[1])[:5]
+    logger.info(f"Top dung lượng và hạng: {top_ranks}")
+
+    if not ranks:
+        logger.warning("Không có giá trị capacity_bytes hợp lệ, storage_ranking sẽ là NULL.")
+    return df.withColumn("storage_ranking", storage_ranking_expr(ranks))
+
+def refresh_storage_ranking(spark: SparkSession, table_dir: Path, ranks: Dict[int, int]) -> List[date]:
+    """
+    Ghi lại storage_ranking của các partition file_date có hạng khác `ranks` (hạng cũ
+    trước khi tập dung lượng toàn cục có thêm giá trị mới). Chỉ đọc 3 cột để tìm partition
+    cần sửa; các partition đó được localCheckpoint trước khi ghi đè chính đường dẫn đang đọc.
+    Trả về danh sách ngày đã ghi lại.
+    """
+    table = spark.read.parquet(str(table_dir))
+    expected = storage_ranking_expr(ranks)
+    stale_dates = sorted(row["file_date"] for row in
+                         table.where(~F.col("storage_ranking").eqNullSafe(expected))
+                              .select("file_date").distinct().collect())
+    if not stale_dates:
+        logger.info("storage_ranking của mọi partition đã khớp bảng xếp hạng toàn cục.")
+        return []
+
+    logger.info(f"Ghi lại storage_ranking cho {len(stale_dates)} ngày: {[str(d) for d in stale_dates]}")
+    # mergeSchema: các ngày có thể khác tập cột SMART, thiếu option này thì cột chỉ có ở
+    # một số ngày bị mất khi ghi đè
+    stale = spark.read.option("basePath", str(table_dir)).option("mergeSchema", "true") \
+        .parquet(*[str(table_dir / f"file_date={d}") for d in stale_dates])
+    rewritten = stale.withColumn("storage_ranking", expected).localCheckpoint()
+    write_daily_partition(rewritten, table_dir)
+    return stale_dates
+
+
+def primary_key_expr(key_columns: List[str], method: str = PRIMARY_KEY_METHOD) -> Column:
+    """
+    Biểu thức tạo khóa chính theo phương thức cấu hình:
+    - "sha256":    mặc định, SHA-256 trên chuỗi concat_ws (chuỗi hex 64 ký tự, giống output cũ).
+    - "xxhash128": khóa 128-bit dạng chuỗi hex 32 ký tự, ghép từ 2 xxhash64 với seed khác nhau.
+    - "xxhash64":  khóa 64-bit (LongType) hash trực tiếp trên các cột đã có kiểu; đổi kiểu cột
+                   primary_key nên không dùng cho bảng đã có dữ liệu khóa chuỗi.
+    """
+    cols = [F.col(c) for c in key_columns]
+    if method == "xxhash64":
+        return F.xxhash64(*cols)
+    if method == "xxhash128":
+        # Thêm một literal ở đầu để đổi trạng thái hash -> nửa thứ hai độc lập với nửa đầu
+        high = F.xxhash64(*cols)
+        low = F.xxhash64(F.lit(PRIMARY_KEY_SALT_128), *cols)
+        return F.concat(F.lpad(F.hex(high), 16, "0"), F.lpad(F.hex(low), 16, "0"))
+    if method == "sha256":
+        return F.sha2(F.concat_ws("||", *cols), 256)
+    raise ValueError(f"Phương thức tạo khóa chính không hợp lệ: {method} "
+                     f"(hỗ trợ: {', '.join(PRIMARY_KEY_METHODS)})")
+
+def validate_primary_key_method(method: str = PRIMARY_KEY_METHOD):
+    """Kiểm tra EX7_PK_METHOD trước khi khởi động Spark, tránh lỗi giữa chừng khi đã đọc dữ liệu."""
+    if method not in PRIMARY_KEY_METHODS:
+        raise ValueError(f"EX7_PK_METHOD không hợp lệ: '{method}' "
+                         f"(hỗ trợ: {', '.join(PRIMARY_KEY_METHODS)})")
+
+def add_primary_key(df: DataFrame, key_columns: List[str], method: str = PRIMARY_KEY_METHOD) -> DataFrame:
     """Câu 5: Thêm cột primary_key bằng hash các cột định danh."""
-    logger.info(f"Câu 5: Thêm cột primary_key từ các cột: {key_columns}")
+    logger.info(f"Câu 5: Thêm cột primary_key ({method}) từ các cột: {key_columns}")
     # Đảm bảo các cột key tồn tại
     missing_cols = [col for col in key_columns if col not in df.columns]
     if missing_cols:
         logger.error(f"Các cột để tạo khóa chính bị thiếu: {missing_cols}")
         # Trả về df gốc để tránh lỗi hoặc thêm cột null
-        return df.withColumn("primary_key", F.lit(None).cast(StringType()))
-
-    # Tạo một cột tạm thời bằng cách nối các cột key (xử lý NULL an toàn)
-    # concat_ws bỏ qua các giá trị NULL
-    df = df.withColumn("_temp_pk_concat", F.concat_ws("||", *key_columns))
+        key_type = LongType() if method == "xxhash64" else StringType()
+        return df.withColumn("primary_key", F.lit(None).cast(key_type))
 
-    # Tạo cột primary_key bằng cách hash cột tạm thời (SHA2-256)
-    df = df.withColumn("primary_key", F.sha2(F.col("_temp_pk_concat"), 256))
+    # Hash trực tiếp trên các cột đã có kiểu, không tạo cột chuỗi trung gian
+    return df.withColumn("primary_key", primary_key_expr(key_columns, method))
 
-    # Xóa cột tạm thời
-    return df.drop("_temp_pk_concat")
-
-# --- Luồng Thực thi Chính ---
-if __name__ == "__main__":
-    logger.info("--- Bắt đầu Exercise 7: PySpark Functions (Đọc trực tiếp từ ZIP) ---")
-
-    spark = None
+def check_primary_key_collisions(df: DataFrame, key_columns: List[str],
+                                 key_col: str = "primary_key", sample_size: int = 10) -> int:
+    """
+    Kiểm tra tính duy nhất của khóa chính: đếm số giá trị khóa được sinh ra
+    từ nhiều tổ hợp key_columns khác nhau (va chạm hash). Trả về số khóa bị va chạm.
+    """
+    logger.info(f"Kiểm tra va chạm khóa chính '{key_col}' trên các cột: {key_columns}")
+    collisions_df = df.groupBy(key_col) \
+        .agg(F.countDistinct(F.struct(*key_columns)).alias("distinct_keys")) \
+        .filter(F.col("distinct_keys") > 1) \
+        .cache()
     try:
-        # Xác định tên file zip đầu vào
-        input_zip_filename = INPUT_ZIP_FILE.name
-
-        spark = create_spark_session()
+        collision_count = collisions_df.count()
+        if collision_count:
+            samples = [row[key_col] for row in collisions_df.limit(sample_size).collect()]
+            logger.error(f"Phát hiện {collision_count} giá trị '{key_col}' bị va chạm. Ví dụ: {samples}")
+        else:
+            logger.info(f"Không có va chạm nào cho '{key_col}'.")
+        return collision_count
+    finally:
+        collisions_df.unpersist()
 
-        # 1. Đọc dữ liệu trực tiếp từ ZIP
-        raw_df = read_zipped_csv(spark, INPUT_ZIP_FILE)
+def enrich_drive_stats(raw_df: DataFrame, source_filename: str,
+                       profiler: Optional[SparkProfiler] = None, step_suffix: str = "") -> DataFrame:
+    """
+    Áp dụng toàn bộ các bước ép kiểu và thêm cột (Câu 1 -> Câu 5) cho một file.
+    Nếu có profiler, bước cast (gồm báo cáo cast thất bại), xếp hạng dung lượng
+    và tạo khóa chính được đo riêng (tên bước + step_suffix, ví dụ ":2022-01-01").
+    """
+    with profile_step(profiler, f"cast_types{step_suffix}"):
+        typed_df = cast_types(raw_df)
+    df_q1 = add_source_file(typed_df, source_filename)
+    df_q2 = add_file_date(df_q1)
+    df_q3 = add_brand(df_q2)
+    with profile_step(profiler, f"add_storage_ranking{step_suffix}"):
+        df_q4 = add_storage_ranking(df_q3)
+    # Dựa vào cấu trúc file, date, serial_number, model có vẻ là bộ khóa hợp lý
+    with profile_step(profiler, f"add_primary_key{step_suffix}"):
+        return add_primary_key(df_q4, PRIMARY_KEY_COLUMNS)
+
+# --- Chế độ xử lý incremental theo ngày ---
+def extract_file_date(filename: str) -> Optional[date]:
+    """Lấy ngày từ tên file (cùng pattern với add_file_date), None nếu không có."""
+    match = re.search(FILE_DATE_PATTERN, filename)
+    if not match:
+        return None
+    try:
+        return datetime.strptime(match.group(1), "%Y-%m-%d").date()
+    except ValueError:
+        return None
 
+def discover_daily_files(input_dir: Path, pattern: str = INPUT_ZIP_GLOB) -> Dict[date, Path]:
+    """Tìm các file ZIP hằng ngày trong input_dir, trả về dict ngày -> đường dẫn."""
+    daily_files: Dict[date, Path] = {}
+    for zip_path in sorted(input_dir.glob(pattern)):
+        file_date = extract_file_date(zip_path.name)
+        if file_date is None:
+            logger.warning(f"Bỏ qua file không có ngày trong tên: {zip_path.name}")
+            continue
+        if file_date in daily_files:
+            logger.warning(f"Trùng ngày {file_date}: dùng {daily_files[file_date].name}, bỏ qua {zip_path.name}")
+            continue
+        daily_files[file_date] = zip_path
+    logger.info(f"Tìm thấy {len(daily_files)} file theo ngày trong {input_dir}")
+    return daily_files
+
+def list_processed_dates(table_dir: Path) -> Set[date]:
+    """Các ngày đã có partition file_date=YYYY-MM-DD (chứa file parquet) trong bảng đầu ra."""
+    processed: Set[date] = set()
+    if not table_dir.exists():
+        return processed
+    for partition_dir in table_dir.glob("file_date=*"):
+        if not any(partition_dir.glob("*.parquet")):
+            continue
+        try:
+            processed.add(datetime.strptime(partition_dir.name.split("=", 1)[1], "%Y-%m-%d").date())
+        except ValueError:
+            logger.warning(f"Bỏ qua partition không hợp lệ: {partition_dir}")
+    return processed
+
+def parse_reprocess_dates(value: str) -> Set[date]:
+    """Parse danh sách ngày dạng "YYYY-MM-DD,YYYY-MM-DD" từ biến môi trường."""
+    dates: Set[date] = set()
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            dates.add(datetime.strptime(item, "%Y-%m-%d").date())
+        except ValueError:
+            logger.warning(f"Bỏ qua ngày không hợp lệ trong EX7_REPROCESS_DATES: {item}")
+    return dates
+
+def write_daily_partition(df: DataFrame, table_dir: Path):
+    """
+    Ghi dữ liệu vào bảng Parquet partition theo file_date.
+    Dùng dynamic partition overwrite: chỉ partition của ngày đang ghi bị thay thế,
+    nên chạy lại cùng một ngày là idempotent và không ảnh hưởng các ngày khác.
+    Lưu ý: ngày có thêm cột SMART mới sẽ cần mergeSchema khi đọc lại toàn bảng.
+    """
+    spark = df.sparkSession
+    spark.conf.set("spark.sql.sources.partitionOverwriteMode", "dynamic")
+    df.drop("file_date_str") \
+      .write \
+      .mode("overwrite") \
+      .partitionBy("file_date") \
+      .parquet(str(table_dir))
+
+def run_incremental(spark: SparkSession, input_dir: Path, table_dir: Path,
+                    reprocess_dates: Optional[Set[date]] = None,
+                    profiler: Optional[SparkProfiler] = None) -> List[date]:
+    """
+    Xử lý incremental: chỉ các ngày chưa có partition trong bảng đầu ra
+    (cộng thêm các ngày được yêu cầu xử lý lại). Trả về danh sách ngày đã ghi.
+    Nếu có profiler, bước đọc, các bước enrich và bước ghi của từng ngày được đo riêng.
+    """
+    reprocess_dates = reprocess_dates or set()
+    daily_files = discover_daily_files(input_dir)
+    processed = list_processed_dates(table_dir)
+
+    missing_reprocess = reprocess_dates - set(daily_files)
+    if missing_reprocess:
+        logger.warning(f"Không tìm thấy file cho các ngày cần xử lý lại: {[str(d) for d in sorted(missing_reprocess)]}")
+
+    pending = sorted(d for d in daily_files if d not in processed or d in reprocess_dates)
+    logger.info(f"Đã xử lý {len(processed)} ngày, cần xử lý {len(pending)} ngày: {[str(d) for d in pending]}")
+
+    # Hạng trước khi xử lý: nếu tập dung lượng có thêm giá trị mới trong lần chạy này
+    # thì các partition đã ghi với hạng cũ phải được ghi lại
+    initial_ranks = load_capacity_ranks([])
+    written: List[date] = []
+    for file_date in pending:
+        zip_path = daily_files[file_date]
+        logger.info(f"--- Xử lý ngày {file_date} từ {zip_path.name} ---")
+        with profile_step(profiler, f"read:{file_date}"):
+            raw_df = read_zipped_csv(spark, zip_path)
         if raw_df is None:
-            logger.error("Không thể đọc dữ liệu từ file ZIP. Dừng xử lý.")
-            exit(1)
-
-        # Cache DataFrame thô sau khi đọc thành công
+            logger.error(f"Không đọc được dữ liệu ngày {file_date}, bỏ qua.")
+            continue
         raw_df.cache()
-        logger.info("DataFrame thô đã được cache.")
-
-        # 2. Ép kiểu dữ liệu
-        typed_df = cast_types(raw_df)
-
-        # 3. Thực hiện các yêu cầu thêm cột
-        df_q1 = add_source_file(typed_df, input_zip_filename)
-        df_q2 = add_file_date(df_q1)
-        df_q3 = add_brand(df_q2)
-        df_q4 = add_storage_ranking(df_q3)
+        try:
+            final_df = enrich_drive_stats(raw_df, zip_path.name, profiler, f":{file_date}")
+            with profile_step(profiler, f"write:{file_date}"):
+                write_daily_partition(final_df, table_dir)
+            written.append(file_date)
+            logger.info(f"Đã ghi partition file_date={file_date} vào {table_dir}")
+        except Exception as e:
+            logger.error(f"Lỗi khi xử lý ngày {file_date}: {e}", exc_info=True)
+        finally:
+            raw_df.unpersist()
+
+    logger.info(f"Hoàn tất incremental: đã ghi {len(written)}/{len(pending)} ngày.")
+
+    final_ranks = load_capacity_ranks([])
+    if written and final_ranks != initial_ranks:
+        with profile_step(profiler, "refresh_storage_ranking"):
+            refresh_storage_ranking(spark, table_dir, final_ranks)
+    return written
+
+# --- Đặc trưng rolling theo ổ đĩa ---
+# Cột của bảng lịch sử -> kiểu (file_date là cột partition, đặt cuối)
+HISTORY_COLUMNS: Dict[str, str] = {
+    "date": "DATE",
+    "serial_number": "STRING",
+    "model": "STRING",
+    "capacity_bytes": "BIGINT",
+    "failure": "INT",
+    **{col_name: "BIGINT" for col_name in SMART_FEATURE_COLUMNS},
+    "file_date": "DATE",
+}
+
+def register_history_table(spark: SparkSession, table_dir: Path = HISTORY_TABLE_DIR):
+    """
+    Đăng ký bảng lịch sử (external, LOCATION = table_dir) vào catalog của session:
+    PARTITIONED BY file_date để chỉ đọc các ngày trong cửa sổ lookback,
+    CLUSTERED BY serial_number để mọi bản ghi của một ổ nằm cùng bucket qua các ngày.
+    Catalog không lưu giữa các lần chạy nên partition đã có được nạp lại từ thư mục.
+    """
+    table_dir.mkdir(parents=True, exist_ok=True)
+    columns = ", ".join(f"{name} {col_type}" for name, col_type in HISTORY_COLUMNS.items())
+    spark.sql(f"""
+        CREATE TABLE IF NOT EXISTS {HISTORY_TABLE} ({columns})
+        USING parquet
+        PARTITIONED BY (file_date)
+        CLUSTERED BY (serial_number) SORTED BY (serial_number, date) INTO {HISTORY_BUCKETS} BUCKETS
+        LOCATION '{table_dir.resolve()}'
+    """)
+    spark.sql(f"ALTER TABLE {HISTORY_TABLE} RECOVER PARTITIONS")
+
+def append_history(spark: SparkSession, days: List[date],
+                   source_dir: Path = OUTPUT_TABLE_DIR) -> None:
+    """
+    Chép các ngày từ bảng drive_stats sang bảng lịch sử (chỉ các cột cần cho đặc trưng).
+    Ghi đè đúng partition của các ngày đó; chỉ dữ liệu các ngày này được shuffle vào bucket.
+    """
+    paths = [str(source_dir / f"file_date={d}") for d in days]
+    # mergeSchema: cột SMART chỉ có ở các ngày mới hơn không bị bỏ khi đọc nhiều ngày
+    source = spark.read.option("basePath", str(source_dir)).option("mergeSchema", "true").parquet(*paths)
+    # Ngày thiếu một cột SMART (Backblaze thêm/bớt cột theo thời gian) -> NULL
+    columns = [
+        F.col(name).cast(col_type).alias(name) if name in source.columns
+        else F.lit(None).cast(col_type).alias(name)
+        for name, col_type in HISTORY_COLUMNS.items()
+    ]
+    spark.conf.set("spark.sql.sources.partitionOverwriteMode", "dynamic")
+    source.select(*columns).write.insertInto(HISTORY_TABLE, overwrite=True)
+
+def affected_feature_dates(new_days: Set[date], history_days: Set[date],
+                           lookback_days: int = max(FEATURE_WINDOWS_DAYS)) -> List[date]:
+    """
+    Ngày cần tính lại đặc trưng: các ngày mới và các ngày đã có nằm trong
+    lookback_days sau một ngày mới (cửa sổ của chúng chứa ngày mới, ví dụ khi xử lý lại ngày cũ).
+    """
+    affected = set(new_days)
+    for day in history_days:
+        if any(0 < (day - new_day).days <= lookback_days for new_day in new_days):
+            affected.add(day)
+    return sorted(affected)
 
-        # Xác định các cột để tạo khóa chính
-        # Dựa vào cấu trúc file, date, serial_number, model có vẻ là bộ khóa hợp lý
-        primary_key_cols = ["date", "serial_number", "model"]
-        final_df = add_primary_key(df_q4, primary_key_cols)
+def rolling_smart_features(history: DataFrame) -> DataFrame:
+    """
+    Delta của từng cột SMART trên mỗi cửa sổ N ngày: giá trị hôm nay trừ giá trị sớm nhất
+    của cùng ổ đĩa trong N ngày trước đó (rangeBetween theo số ngày nên đúng cả khi thiếu ngày).
+    history đọc từ bảng bucket theo serial_number nên Window không cần Exchange.
+    """
+    day_number = F.datediff(F.col("date"), F.lit("1970-01-01").cast(DateType()))
+    by_drive = Window.partitionBy("serial_number").orderBy(day_number)
+    features = [
+        (F.col(col_name) - F.first(col_name, ignorenulls=True).over(by_drive.rangeBetween(-days, 0)))
+        .alias(f"{col_name}_delta_{days}d")
+        for col_name in SMART_FEATURE_COLUMNS
+        for days in FEATURE_WINDOWS_DAYS
+    ]
+    return history.select(*history.columns, *features)
+
+def update_drive_features(spark: SparkSession, refresh_dates: Optional[Set[date]] = None,
+                          source_dir: Path = OUTPUT_TABLE_DIR,
+                          features_dir: Path = FEATURES_TABLE_DIR,
+                          profiler: Optional[SparkProfiler] = None) -> List[date]:
+    """
+    Nối các ngày mới của drive_stats vào bảng lịch sử rồi chỉ tính đặc trưng cho các ngày
+    bị ảnh hưởng, đọc thêm max(FEATURE_WINDOWS_DAYS) ngày trước đó làm lookback.
+    refresh_dates: các ngày vừa được ghi lại trong drive_stats (xử lý lại).
+    Trả về danh sách ngày đã ghi đặc trưng.
+    """
+    register_history_table(spark)
+    history_days = list_processed_dates(HISTORY_TABLE_DIR)
+    new_days = (list_processed_dates(source_dir) - history_days) | (refresh_dates or set())
+    if not new_days:
+        logger.info("Bảng lịch sử đã có mọi ngày của drive_stats, không cần tính đặc trưng.")
+        return []
+
+    logger.info(f"Nối {len(new_days)} ngày vào {HISTORY_TABLE}: {[str(d) for d in sorted(new_days)]}")
+    with profile_step(profiler, "append_history"):
+        append_history(spark, sorted(new_days), source_dir)
+    spark.catalog.refreshTable(HISTORY_TABLE)
+
+    feature_days = affected_feature_dates(new_days, history_days | new_days)
+    lookback_start = feature_days[0] - timedelta(days=max(FEATURE_WINDOWS_DAYS))
+    history = spark.table(HISTORY_TABLE) \
+        .where(F.col("file_date").between(F.lit(lookback_start), F.lit(feature_days[-1])))
+    # Lọc ngày cần ghi sau Window: các ngày lookback chỉ dùng làm cửa sổ
+    features = rolling_smart_features(history) \
+        .where(F.col("file_date").isin(feature_days))
+    with profile_step(profiler, "write_drive_features"):
+        write_daily_partition(features, features_dir)
+    logger.info(f"Đã ghi đặc trưng cho {len(feature_days)} ngày vào {features_dir} "
+                f"(lookback từ {lookback_start})")
+    return feature_days
 
-        # 4. Hiển thị kết quả cuối cùng
-        logger.info("--- Schema cuối cùng ---")
-        final_df.printSchema()
+# --- Luồng Thực thi Chính ---
+if __name__ == "__main__":
+    logger.info("--- Bắt đầu Exercise 7: PySpark Functions (Đọc trực tiếp từ ZIP) ---")
 
-        logger.info("--- 10 dòng dữ liệu cuối cùng (có thể bị cắt ngắn) ---")
-        final_df.show(10, truncate=True) # truncate=True để log gọn hơn
+    try:
+        validate_primary_key_method()
+    except ValueError as e:
+        logger.error(str(e))
+        exit(1)
+    logger.info(f"Phương thức tạo primary_key: {PRIMARY_KEY_METHOD}")
 
-        # Unpersist DataFrame thô
-        raw_df.unpersist()
-        logger.info("Đã unpersist DataFrame thô.")
+    spark = None
+    profiler = None # Đo thời gian/metric Spark của từng bước
+    try:
+        spark = create_spark_session()
+        profiler = SparkProfiler(spark, f"exercise7-{PIPELINE_MODE}")
+
+        if PIPELINE_MODE == "incremental":
+            logger.info(f"Chế độ incremental: {INPUT_DIR} -> {OUTPUT_TABLE_DIR}")
+            written_dates = run_incremental(spark, INPUT_DIR, OUTPUT_TABLE_DIR,
+                                            parse_reprocess_dates(REPROCESS_DATES), profiler=profiler)
+            update_drive_features(spark, set(written_dates), profiler=profiler)
+        else:
+            # Xác định tên file zip đầu vào
+            input_zip_filename = INPUT_ZIP_FILE.name
+
+            # 1. Đọc dữ liệu trực tiếp từ ZIP
+            with profiler.step("read_zipped_csv"):
+                raw_df = read_zipped_csv(spark, INPUT_ZIP_FILE)
+
+            if raw_df is None:
+                logger.error("Không thể đọc dữ liệu từ file ZIP. Dừng xử lý.")
+                exit(1)
+
+            # Cache DataFrame thô sau khi đọc thành công
+            raw_df.cache()
+            logger.info("DataFrame thô đã được cache.")
+
+            # 2. Ép kiểu dữ liệu và 3. thực hiện các yêu cầu thêm cột
+            final_df = enrich_drive_stats(raw_df, input_zip_filename, profiler)
+            with profiler.step("check_primary_key_collisions"):
+                check_primary_key_collisions(final_df, PRIMARY_KEY_COLUMNS)
+
+            # 4. Hiển thị kết quả cuối cùng
+            logger.info("--- Schema cuối cùng ---")
+            final_df.printSchema()
+
+            logger.info("--- 10 dòng dữ liệu cuối cùng (có thể bị cắt ngắn) ---")
+            with profiler.step("show"):
+                final_df.show(10, truncate=True) # truncate=True để log gọn hơn
+
+            # Unpersist DataFrame thô
+            raw_df.unpersist()
+            logger.info("Đã unpersist DataFrame thô.")
 
     except Exception as e:
          logger.error(f"Lỗi không mong muốn trong quá trình xử lý chính: {e}", exc_info=True)
          exit(1)
     finally:
+        if profiler and profiler.steps:
+            profiler.write_report()
         if spark:
             logger.info("Đang dừng SparkSession...")
             spark.stop()
@@ -0,0 +1,511 @@
+"""
+Benchmark so sánh DuckDB, Polars và Spark trên cùng các truy vấn phân tích.
+
+Mỗi lần đo (engine, dataset, scale, query) chạy trong một process con riêng
+để đo chính xác peak RSS và CPU time (bao gồm cả JVM của Spark):
+
+    python benchmark.py                      # mặc định: mọi engine có sẵn, scale 1 10 100
+    python benchmark.py --engines duckdb polars --scales 1 10
+    python benchmark.py --datasets divvy --queries group_by window
+
+Kết quả được ghi nối tiếp vào bench_results/results.csv.
+"""
+import argparse
+import csv
+import importlib.util
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# --- Cấu hình Logging ---
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+# --- Hằng số và Đường dẫn ---
+BASE_DIR = Path(__file__).resolve().parent
+DATASETS: Dict[str, Path] = {
+    "electric_cars": BASE_DIR / "data" / "electric-cars.csv",
+    "divvy": BASE_DIR.parent / "Exercise-9" / "data" / "202306-divvy-tripdata.csv",
+}
+BENCH_DATA_DIR = BASE_DIR / "bench_data"
+RESULTS_FILE = BASE_DIR / "bench_results" / "results.csv"
+ENGINES = ["duckdb", "polars", "spark"]
+QUERIES = ["group_by", "top_n_per_group", "window"]
+DEFAULT_SCALES = [1, 10, 100]
+TOP_N = 3
+# Cột khóa (tên gốc trong CSV) được gắn hậu tố theo bản sao khi nhân bản dữ liệu
+SCALE_KEY_COLUMNS: Dict[str, List[str]] = {
+    "electric_cars": ["City", "Make", "Model"],
+    "divvy": ["start_station_name"],
+}
+# Thời gian tối đa cho một lần đo (giây)
+RUN_TIMEOUT = int(os.getenv("BENCH_TIMEOUT", "1800"))
+
+# Dòng cuối của traceback, ví dụ "duckdb.duckdb.ParserException: Parser Error: ..."
+EXCEPTION_LINE = re.compile(r"^[\w.]+(Error|Exception|Exit|Interrupt)\b")
+
+RESULT_FIELDS = [
+    "run_at", "engine", "dataset", "scale", "query", "status", "rows",
+    "query_wall_s", "process_wall_s", "cpu_s", "peak_rss_mb", "input_mb", "error",
+]
+
+# --- Truy vấn SQL dùng chung cho DuckDB và Spark SQL ---
+# Tên cột đã được chuẩn hóa về snake_case (xem normalize_column_name),
+# bảng nguồn luôn tên là "src". Không dùng QUALIFY vì Spark chưa hỗ trợ.
+SQL_QUERIES: Dict[str, Dict[str, str]] = {
+    "electric_cars": {
+        "group_by": """
+            SELECT city, count(*) AS vehicle_count
+            FROM src
+            GROUP BY city
+        """,
+        "top_n_per_group": f"""
+            SELECT postal_code, make, model, vehicle_count FROM (
+                SELECT postal_code, make, model, vehicle_count,
+                       row_number() OVER (PARTITION BY postal_code
+                                          ORDER BY vehicle_count DESC, make, model) AS rn
+                FROM (
+                    SELECT postal_code, make, model, count(*) AS vehicle_count
+                    FROM src
+                    GROUP BY postal_code, make, model
+                ) counts
+            ) ranked
+            WHERE rn <= {TOP_N}
+        """,
+        "window": """
+            SELECT make, model_year, vehicle_count,
+                   sum(vehicle_count) OVER (PARTITION BY make ORDER BY model_year) AS cumulative_count
+            FROM (
+                SELECT make, model_year, count(*) AS vehicle_count
+                FROM src
+                GROUP BY make, model_year
+            ) counts
+        """,
+    },
+    "divvy": {
+        "group_by": """
+            SELECT CAST(started_at AS DATE) AS ride_date, count(*) AS ride_count
+            FROM src
+            GROUP BY CAST(started_at AS DATE)
+        """,
+        "top_n_per_group": f"""
+            SELECT ride_date, start_station_name, ride_count FROM (
+                SELECT ride_date, start_station_name, ride_count,
+                       row_number() OVER (PARTITION BY ride_date
+                                          ORDER BY ride_count DESC, start_station_name) AS rn
+                FROM (
+                    SELECT CAST(started_at AS DATE) AS ride_date, start_station_name, count(*) AS ride_count
+                    FROM src
+                    WHERE start_station_name IS NOT NULL
+                    GROUP BY CAST(started_at AS DATE), start_station_name
+                ) counts
+            ) ranked
+            WHERE rn <= {TOP_N}
+        """,
+        "window": """
+            SELECT ride_date, ride_count,
+                   ride_count - lag(ride_count, 7) OVER (ORDER BY ride_date) AS diff_vs_last_week
+            FROM (
+                SELECT CAST(started_at AS DATE) AS ride_date, count(*) AS ride_count
+                FROM src
+                GROUP BY CAST(started_at AS DATE)
+            ) daily
+        """,
+    },
+}
+
+
+def normalize_column_name(name: str) -> str:
+    """'Postal Code' -> 'postal_code', 'VIN (1-10)' -> 'vin_1_10'."""
+    cleaned = "".join(ch.lower() if ch.isalnum() else "_" for ch in name.strip())
+    return "_".join(part for part in cleaned.split("_") if part)
+
+
+def sql_literal(path: Path) -> str:
+    return "'" + str(path).replace("'", "''") + "'"
+
+
+# --- Sinh dữ liệu theo scale ---
+
+def scaled_dataset(dataset: str, scale: int) -> Path:
+    """
+    Trả về file CSV gồm `scale` bản sao của dữ liệu gốc, sinh bằng DuckDB nếu chưa có.
+    Bản sao thứ i > 0 có các cột khóa (SCALE_KEY_COLUMNS) gắn hậu tố "#i", nên số nhóm
+    tăng theo scale và các truy vấn group by/window phải dựng hash table lớn hơn.
+    Mọi cột đọc/ghi dạng chuỗi để giữ nguyên giá trị gốc. scale = 1 dùng trực tiếp file gốc.
+    """
+    source = DATASETS[dataset]
+    if not source.is_file():
+        raise FileNotFoundError(f"Không tìm thấy dữ liệu nguồn cho '{dataset}': {source}")
+    if scale == 1:
+        return source
+
+    target = BENCH_DATA_DIR / f"{source.stem}-keys-x{scale}.csv"
+    if target.is_file() and target.stat().st_mtime >= source.stat().st_mtime:
+        return target
+
+    import duckdb
+
+    logger.info(f"Đang sinh dữ liệu {dataset} x{scale}: {target}")
+    BENCH_DATA_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_target = target.with_suffix(".tmp")
+    conn = duckdb.connect()
+    try:
+        source_sql = "read_csv(" + sql_literal(source) + ", header = true, all_varchar = true)"
+        columns = [col[0] for col in conn.execute(f"SELECT * FROM {source_sql} LIMIT 0").description]
+        keys = SCALE_KEY_COLUMNS[dataset]
+        select = ", ".join(
+            f'CASE WHEN copy_id = 0 THEN "{col}" ELSE "{col}" || \'#\' || copy_id END AS "{col}"'
+            if col in keys else f'"{col}"'
+            for col in columns
+        )
+        conn.execute(
+            f"COPY (SELECT {select} FROM range({scale}) copies(copy_id), {source_sql}) "
+            f"TO {sql_literal(tmp_target)} (FORMAT csv, HEADER, DELIMITER ',')"
+        )
+    finally:
+        conn.close()
+    tmp_target.replace(target)
+    return target
+
+
+# --- Cài đặt truy vấn cho từng engine (chạy trong process con) ---
+# Mỗi hàm trả về (số dòng kết quả, thời gian chạy truy vấn) - không tính thời gian
+# khởi tạo engine (ví dụ khởi động JVM của Spark); thời gian đó nằm trong process_wall_s.
+
+def run_duckdb(dataset: str, query: str, csv_path: Path) -> Tuple[int, float]:
+    import duckdb
+
+    conn = duckdb.connect()
+    source = "read_csv(" + sql_literal(csv_path) + ", header = true, parallel = true)"
+    columns = [col[0] for col in conn.execute(f"SELECT * FROM {source} LIMIT 0").description]
+    # Alias cần quote: tên như "2020 Census Tract" -> 2020_census_tract bắt đầu bằng chữ số
+    renames = ", ".join(f'"{col}" AS "{normalize_column_name(col)}"' for col in columns)
+    conn.execute(f"CREATE VIEW src AS SELECT {renames} FROM {source}")
+    start = time.perf_counter()
+    rows = len(conn.execute(SQL_QUERIES[dataset][query]).fetchall())
+    return rows, time.perf_counter() - start
+
+def run_spark(dataset: str, query: str, csv_path: Path) -> Tuple[int, float]:
+    from pyspark.sql import SparkSession
+
+    spark = SparkSession.builder \
+        .appName(f"bench-{dataset}-{query}") \
+        .master("local[*]") \
+        .config("spark.sql.adaptive.enabled", "true") \
+        .config("spark.ui.enabled", "false") \
+        .getOrCreate()
+    try:
+        # Không inferSchema để tránh thêm một lần quét file; các truy vấn tự CAST khi cần
+        df = spark.read.csv(str(csv_path), header=True)
+        df = df.toDF(*[normalize_column_name(c) for c in df.columns])
+        df.createOrReplaceTempView("src")
+        start = time.perf_counter()
+        rows = len(spark.sql(SQL_QUERIES[dataset][query]).collect())
+        return rows, time.perf_counter() - start
+    finally:
+        spark.stop()
+
+def run_polars(dataset: str, query: str, csv_path: Path) -> Tuple[int, float]:
+    import polars as pl
+
+    lf = pl.scan_csv(csv_path, infer_schema_length=10000)
+    lf = lf.rename({c: normalize_column_name(c) for c in lf.collect_schema().names()})
+
+    if dataset == "electric_cars":
+        if query == "group_by":
+            result = lf.group_by("city").agg(pl.len().alias("vehicle_count"))
+        elif query == "top_n_per_group":
+            result = lf.group_by("postal_code", "make", "model") \
+                .agg(pl.len().alias("vehicle_count")) \
+                .sort(["vehicle_count", "make", "model"], descending=[True, False, False]) \
+                .group_by("postal_code", maintain_order=True) \
+                .head(TOP_N)
+        else:
+            result = lf.group_by("make", "model_year") \
+                .agg(pl.len().alias("vehicle_count")) \
+                .sort("make", "model_year") \
+                .with_columns(pl.col("vehicle_count").cum_sum().over("make").alias("cumulative_count"))
+    else:
+        lf = lf.with_columns(
+            pl.col("started_at").str.to_datetime("%Y-%m-%d %H:%M:%S").dt.date().alias("ride_date")
+        )
+        if query == "group_by":
+            result = lf.group_by("ride_date").agg(pl.len().alias("ride_count"))
+        elif query == "top_n_per_group":
+            result = lf.filter(pl.col("start_station_name").is_not_null()) \
+                .group_by("ride_date", "start_station_name") \
+                .agg(pl.len().alias("ride_count")) \
+                .sort(["ride_count", "start_station_name"], descending=[True, False]) \
+                .group_by("ride_date", maintain_order=True) \
+                .head(TOP_N)
+        else:
+            result = lf.group_by("ride_date").agg(pl.len().alias("ride_count")) \
+                .sort("ride_date") \
+                .with_columns((pl.col("ride_count") - pl.col("ride_count").shift(7)).alias("diff_vs_last_week"))
+    start = time.perf_counter()
+    rows = result.collect().height
+    return rows, time.perf_counter() - start
+
+ENGINE_RUNNERS = {
+    "duckdb": run_duckdb,
+    "polars": run_polars,
+    "spark": run_spark,
+}
+ENGINE_MODULES = {
+    "duckdb": "duckdb",
+    "polars": "polars",
+    "spark": "pyspark",
+}
+
+
+def worker(engine: str, dataset: str, query: str, csv_path: Path):
+    """
+    Chạy một truy vấn và in kết quả dạng JSON ra stdout (dòng cuối).
+    Lỗi cũng được in dạng JSON ({"error": ...}) rồi thoát mã 1, để process cha ghi
+    được nguyên nhân thay vì dòng cuối của traceback (ví dụ dấu ^ của parser DuckDB).
+    """
+    try:
+        rows, elapsed = ENGINE_RUNNERS[engine](dataset, query, csv_path)
+    except Exception as exc:
+        print(json.dumps({"error": repr(exc)}), flush=True)
+        raise
+    print(json.dumps({"rows": rows, "query_wall_s": round(elapsed, 4)}))
+
+
+# --- Điều phối (process cha) ---
+
+class ProcessTreeSampler(threading.Thread):
+    """
+    Lấy mẫu định kỳ RSS và CPU time của một process cùng toàn bộ con cháu qua /proc (Linux).
+    Cần thiết cho Spark: JVM là process cháu và thường không được reap qua wait4,
+    nên rusage của process con không phản ánh bộ nhớ/CPU của JVM.
+    """
+
+    def __init__(self, root_pid: int, interval: float = 0.1):
+        super().__init__(daemon=True)
+        self.root_pid = root_pid
+        self.interval = interval
+        self.peak_rss_bytes = 0
+        self.cpu_by_pid: Dict[int, float] = {}
+        self._stop_event = threading.Event()
+        self._clock_ticks = os.sysconf("SC_CLK_TCK")
+        self._page_size = os.sysconf("SC_PAGE_SIZE")
+
+    def _snapshot(self) -> Dict[int, Tuple[int, float]]:
+        """pid -> (rss_bytes, cpu_seconds) của root_pid và các process con cháu."""
+        stats: Dict[int, Tuple[int, int, float]] = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat", "r") as f:
+                    # Tên process nằm trong ngoặc và có thể chứa khoảng trắng -> tách sau ')'
+                    fields = f.read().rsplit(")", 1)[1].split()
+            except (OSError, IndexError):
+                continue
+            ppid = int(fields[1])
+            cpu = (int(fields[11]) + int(fields[12])) / self._clock_ticks
+            rss = int(fields[21]) * self._page_size
+            stats[int(entry)] = (ppid, rss, cpu)
+
+        tree: Dict[int, Tuple[int, float]] = {}
+        pending = [self.root_pid]
+        while pending:
+            pid = pending.pop()
+            if pid in tree or pid not in stats:
+                continue
+            tree[pid] = stats[pid][1:]
+            pending.extend(child for child, (ppid, _, _) in stats.items() if ppid == pid)
+        return tree
+
+    def run(self):
+        if not os.path.isdir("/proc"):
+            return
+        while not self._stop_event.is_set():
+            tree = self._snapshot()
+            self.peak_rss_bytes = max(self.peak_rss_bytes, sum(rss for rss, _ in tree.values()))
+            for pid, (_, cpu) in tree.items():
+                self.cpu_by_pid[pid] = cpu
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    @property
+    def cpu_seconds(self) -> float:
+        return sum(self.cpu_by_pid.values())
+
+
+def worker_error(stdout: str, stderr: str) -> str:
+    """
+    Nguyên nhân lỗi của worker: JSON {"error": ...} nếu worker kịp in, ngược lại
+    dòng exception cuối cùng trong stderr (bỏ dòng trống, dòng thụt lề và dấu ^ chỉ vị trí).
+    """
+    for line in reversed(stdout.strip().splitlines()):
+        try:
+            payload = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(payload, dict) and "error" in payload:
+            return payload["error"]
+    candidates = [line.strip() for line in stderr.splitlines()
+                  if line.strip() and not line[0].isspace() and set(line.strip()) != {"^"}]
+    # Ưu tiên dòng "XxxError: ..." / "XxxException: ..." của traceback (DuckDB in thêm
+    # "LINE 1: ..." sau thông báo lỗi)
+    exception_lines = [line for line in candidates if EXCEPTION_LINE.match(line)]
+    if exception_lines:
+        return exception_lines[-1]
+    return candidates[-1] if candidates else ""
+
+def run_one(engine: str, dataset: str, scale: int, query: str, csv_path: Path) -> Dict:
+    """
+    Chạy worker trong process con và đo wall time, CPU time, peak RSS.
+    Kết hợp os.wait4 (rusage của riêng process con, không cộng dồn như RUSAGE_CHILDREN)
+    với ProcessTreeSampler (bắt cả các process cháu như JVM của Spark), lấy giá trị lớn hơn.
+    """
+    result = {
+        "run_at": datetime.now().isoformat(timespec="seconds"),
+        "engine": engine, "dataset": dataset, "scale": scale, "query": query,
+        "input_mb": round(csv_path.stat().st_size / 1e6, 2),
+        "status": "ok", "rows": "", "query_wall_s": "", "error": "",
+    }
+    cmd = [sys.executable, str(Path(__file__).resolve()), "--worker",
+           engine, dataset, query, str(csv_path)]
+
+    with tempfile.TemporaryFile("w+") as out, tempfile.TemporaryFile("w+") as err:
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmd, stdout=out, stderr=err, text=True)
+        sampler = ProcessTreeSampler(proc.pid)
+        sampler.start()
+        timer = threading.Timer(RUN_TIMEOUT, proc.kill)
+        timer.start()
+        try:
+            _, status, usage = os.wait4(proc.pid, 0)
+        finally:
+            timer.cancel()
+            sampler.stop()
+        proc.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+        result["process_wall_s"] = round(time.perf_counter() - start, 4)
+        result["cpu_s"] = round(max(usage.ru_utime + usage.ru_stime, sampler.cpu_seconds), 4)
+        # Linux trả ru_maxrss theo KB
+        peak_rss_bytes = max(usage.ru_maxrss * 1024, sampler.peak_rss_bytes)
+        result["peak_rss_mb"] = round(peak_rss_bytes / (1024 * 1024), 1)
+
+        out.seek(0)
+        err.seek(0)
+        stdout, stderr = out.read(), err.read()
+
+    if proc.returncode != 0:
+        result["status"] = "timeout" if result["process_wall_s"] >= RUN_TIMEOUT else "error"
+        result["error"] = worker_error(stdout, stderr) or f"exit code {proc.returncode}"
+        return result
+
+    result.update(json.loads(stdout.strip().splitlines()[-1]))
+    return result
+
+def available_engines(requested: Optional[List[str]]) -> List[str]:
+    """
+    Lọc các engine đã cài đặt thư viện. Engine chỉ định qua --engines mà thiếu thư viện
+    là lỗi (tránh benchmark so sánh với "không có gì"); với mặc định thì bỏ qua có cảnh báo.
+    """
+    engines = []
+    missing = []
+    for engine in requested or ENGINES:
+        if importlib.util.find_spec(ENGINE_MODULES[engine]) is None:
+            missing.append(engine)
+            continue
+        engines.append(engine)
+    for engine in missing:
+        message = f"engine '{engine}': chưa cài đặt '{ENGINE_MODULES[engine]}'."
+        if requested:
+            raise RuntimeError(f"Không chạy được {message}")
+        logger.warning(f"Bỏ qua {message}")
+    return engines
+
+def append_results(results: List[Dict], results_file: Path = RESULTS_FILE):
+    """Ghi nối tiếp kết quả vào file CSV (tạo header nếu file mới)."""
+    results_file.parent.mkdir(parents=True, exist_ok=True)
+    is_new = not results_file.exists()
+    with results_file.open("a", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS, extrasaction="ignore")
+        if is_new:
+            writer.writeheader()
+        writer.writerows(results)
+
+def run_benchmark(engines: List[str], datasets: List[str], scales: List[int],
+                  queries: List[str]) -> List[Dict]:
+    """Chạy toàn bộ ma trận (dataset, scale, engine, query) và trả về danh sách kết quả."""
+    results = []
+    for dataset in datasets:
+        for scale in scales:
+            try:
+                csv_path = scaled_dataset(dataset, scale)
+            except FileNotFoundError as e:
+                logger.error(str(e))
+                break
+            for engine in engines:
+                for query in queries:
+                    logger.info(f"Đo {engine} | {dataset} x{scale} | {query}...")
+                    result = run_one(engine, dataset, scale, query, csv_path)
+                    logger.info(
+                        f"  -> {result['status']} query={result['query_wall_s']}s "
+                        f"process={result['process_wall_s']}s cpu={result['cpu_s']}s "
+                        f"rss={result['peak_rss_mb']}MB {result['error']}"
+                    )
+                    results.append(result)
+                    # Ghi ngay sau mỗi lần đo để không mất kết quả nếu bị dừng giữa chừng
+                    append_results([result])
+    return results
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark DuckDB vs Polars vs Spark")
+    parser.add_argument("--engines", nargs="+", choices=ENGINES,
+                        help="Mặc định: mọi engine đã cài đặt; engine chỉ định mà thiếu thư viện là lỗi")
+    parser.add_argument("--datasets", nargs="+", choices=list(DATASETS), default=list(DATASETS))
+    parser.add_argument("--scales", nargs="+", type=int, default=DEFAULT_SCALES)
+    parser.add_argument("--queries", nargs="+", choices=QUERIES, default=QUERIES)
+    parser.add_argument("--worker", nargs=4, metavar=("ENGINE", "DATASET", "QUERY", "CSV_PATH"),
+                        help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    if args.worker:
+        engine, dataset, query, csv_path = args.worker
+        worker(engine, dataset, query, Path(csv_path))
+        return
+
+    logger.info("--- Bắt đầu benchmark Exercise 8 ---")
+    try:
+        engines = available_engines(args.engines)
+    except RuntimeError as e:
+        logger.error(str(e))
+        exit(1)
+    if not engines:
+        logger.error("Không có engine nào khả dụng để chạy benchmark.")
+        exit(1)
+    results = run_benchmark(engines, args.datasets, args.scales, args.queries)
+    failed = [r for r in results if r["status"] != "ok"]
+    logger.info(f"Hoàn tất {len(results)} lần đo ({len(failed)} lỗi). Kết quả: {RESULTS_FILE}")
+    logger.info("--- Kết thúc benchmark ---")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,488 @@
+import hashlib
+import logging
+import math
+import os
+from pathlib import Path
+from typing import Optional, Tuple
+
 import duckdb
 
+# --- Cấu hình Logging ---
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+# --- Hằng số và Đường dẫn ---
+DATA_DIR = Path("data")
+INPUT_CSV = DATA_DIR / "electric-cars.csv"
+OUTPUT_DIR = Path("output")
+MODEL_YEAR_OUTPUT_DIR = OUTPUT_DIR / "model_year_counts"
+TABLE_NAME = "electric_cars"
+# File DuckDB lưu lâu dài: bảng gốc + các bảng tổng hợp, không phải parse lại CSV mỗi lần chạy
+DATABASE_FILE = Path(os.getenv("DUCKDB_DATABASE", "db/electric_cars.duckdb"))
+# Bảng lưu fingerprint của file nguồn đã nạp
+SOURCE_STATE_TABLE = "_source_state"
+# Các bảng tổng hợp được làm mới cùng lúc với bảng gốc
+CITY_SUMMARY_TABLE = "city_summary"
+POSTAL_CODE_SUMMARY_TABLE = "postal_code_summary"
+MODEL_YEAR_SUMMARY_TABLE = "model_year_summary"
+# Chỉ mục lưới không gian: mỗi xe có tọa độ được gán vào một ô lưới cố định
+GRID_TABLE = "vehicle_grid"
+GRID_CELL_TABLE = "vehicle_grid_cells"
+# Cạnh ô lưới theo độ (0.05° ~ 5.5 km theo vĩ độ). Đổi giá trị này phải xóa
+# GRID_TABLE để chỉ mục được dựng lại (xem ensure_grid_index)
+GRID_CELL_DEGREES = 0.05
+# Điểm và vùng mẫu cho các truy vấn không gian trong main(): trung tâm Seattle, bán kính 5 km
+SAMPLE_POINT = (47.6062, -122.3321)
+SAMPLE_RADIUS_KM = 5.0
+SAMPLE_BBOX = (47.40, -122.50, 47.80, -122.10)  # (min_lat, min_lon, max_lat, max_lon)
+# Bán kính Trái Đất trung bình (km) cho công thức haversine
+EARTH_RADIUS_KM = 6371.0088
+
+# --- Cấu hình DuckDB (đọc từ biến môi trường) ---
+# Số luồng: mặc định DuckDB dùng toàn bộ CPU
+DUCKDB_THREADS = int(os.getenv("DUCKDB_THREADS", str(os.cpu_count() or 4)))
+# Giới hạn bộ nhớ, ví dụ "2GB"; vượt quá sẽ spill ra đĩa thay vì OOM
+DUCKDB_MEMORY_LIMIT = os.getenv("DUCKDB_MEMORY_LIMIT", "2GB")
+
+# --- Định nghĩa Schema ---
+# Tên cột gốc trong CSV -> kiểu đọc từ CSV (khai báo tường minh, không auto-detect)
+# Postal Code / 2020 Census Tract giữ VARCHAR để không mất số 0 ở đầu (ví dụ 06073005102)
+CSV_COLUMNS = {
+    "VIN (1-10)": "VARCHAR",
+    "County": "VARCHAR",
+    "City": "VARCHAR",
+    "State": "VARCHAR",
+    "Postal Code": "VARCHAR",
+    "Model Year": "SMALLINT",
+    "Make": "VARCHAR",
+    "Model": "VARCHAR",
+    "Electric Vehicle Type": "VARCHAR",
+    "Clean Alternative Fuel Vehicle (CAFV) Eligibility": "VARCHAR",
+    "Electric Range": "INTEGER",
+    "Base MSRP": "INTEGER",
+    "Legislative District": "SMALLINT",
+    "DOL Vehicle ID": "BIGINT",
+    "Vehicle Location": "VARCHAR",
+    "Electric Utility": "VARCHAR",
+    "2020 Census Tract": "VARCHAR",
+}
+
+CREATE_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+    vin                  VARCHAR(10),
+    county               VARCHAR,
+    city                 VARCHAR,
+    state                VARCHAR(2),
+    postal_code          VARCHAR,
+    model_year           SMALLINT,
+    make                 VARCHAR,
+    model                VARCHAR,
+    ev_type              VARCHAR,
+    cafv_eligibility     VARCHAR,
+    electric_range       INTEGER,
+    base_msrp            INTEGER,
+    legislative_district SMALLINT,
+    dol_vehicle_id       BIGINT,
+    vehicle_location     VARCHAR,      -- WKT gốc: POINT (lon lat)
+    longitude            DOUBLE,       -- parse từ vehicle_location
+    latitude             DOUBLE,       -- parse từ vehicle_location
+    electric_utility     VARCHAR,
+    census_tract_2020    VARCHAR
+);
+"""
+
+CREATE_SOURCE_STATE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {SOURCE_STATE_TABLE} (
+    source_path VARCHAR PRIMARY KEY,
+    size_bytes  BIGINT,
+    mtime_ns    BIGINT,
+    sha256      VARCHAR,
+    row_count   BIGINT,
+    loaded_at   TIMESTAMP
+);
+"""
+
+# Khoảng cách haversine (km) từ điểm ($lat, $lon) đến tọa độ của từng dòng
+HAVERSINE_KM_SQL = f"""
+    2 * {EARTH_RADIUS_KM} * asin(sqrt(
+        pow(sin(radians(latitude - $lat) / 2), 2)
+        + cos(radians($lat)) * cos(radians(latitude)) * pow(sin(radians(longitude - $lon) / 2), 2)
+    ))
+"""
+
+# Regex cho WKT "POINT (-120.56916 46.58514)": group 1 = lon, group 2 = lat
+POINT_REGEX = r"POINT \(([-+0-9.eE]+) ([-+0-9.eE]+)\)"
+
+
+# --- Các Hàm Hỗ trợ ---
+
+def _sql_literal(value: str) -> str:
+    """Chuỗi SQL literal (escape dấu nháy đơn)."""
+    return "'" + value.replace("'", "''") + "'"
+
+def create_connection(database: str = ":memory:",
+                      threads: int = DUCKDB_THREADS,
+                      memory_limit: str = DUCKDB_MEMORY_LIMIT) -> duckdb.DuckDBPyConnection:
+    """Tạo kết nối DuckDB với số luồng và giới hạn bộ nhớ cấu hình được."""
+    logger.info(f"Đang kết nối DuckDB: database={database} threads={threads} memory_limit={memory_limit}")
+    conn = duckdb.connect(database, config={"threads": threads, "memory_limit": memory_limit})
+    return conn
+
+def create_table(conn: duckdb.DuckDBPyConnection):
+    """Câu 1: Tạo bảng với DDL và kiểu dữ liệu phù hợp."""
+    logger.info(f"Câu 1: Tạo bảng {TABLE_NAME}...")
+    conn.execute(CREATE_TABLE_SQL)
+    conn.execute(CREATE_SOURCE_STATE_SQL)
+
+def load_csv(conn: duckdb.DuckDBPyConnection, csv_path: Path) -> int:
+    """
+    Câu 2: Nạp file CSV vào bảng bằng read_csv song song của DuckDB.
+    Kiểu cột được khai báo tường minh (không auto-detect) và tọa độ
+    được parse từ Vehicle Location ngay trong lần nạp. Trả về số dòng đã nạp.
+    """
+    if not csv_path.is_file():
+        raise FileNotFoundError(f"Không tìm thấy file CSV: {csv_path}")
+
+    logger.info(f"Câu 2: Nạp dữ liệu từ {csv_path} vào bảng {TABLE_NAME}...")
+    columns_struct = "{" + ", ".join(
+        f"{_sql_literal(name)}: {_sql_literal(col_type)}" for name, col_type in CSV_COLUMNS.items()
+    ) + "}"
+    point = _sql_literal(POINT_REGEX)
+    conn.execute(f"""
+        INSERT INTO {TABLE_NAME}
+        SELECT
+            "VIN (1-10)",
+            "County",
+            "City",
+            "State",
+            "Postal Code",
+            "Model Year",
+            "Make",
+            "Model",
+            "Electric Vehicle Type",
+            "Clean Alternative Fuel Vehicle (CAFV) Eligibility",
+            "Electric Range",
+            "Base MSRP",
+            "Legislative District",
+            "DOL Vehicle ID",
+            "Vehicle Location",
+            TRY_CAST(NULLIF(regexp_extract("Vehicle Location", {point}, 1), '') AS DOUBLE),
+            TRY_CAST(NULLIF(regexp_extract("Vehicle Location", {point}, 2), '') AS DOUBLE),
+            "Electric Utility",
+            "2020 Census Tract"
+        FROM read_csv({_sql_literal(str(csv_path))},
+                      header = true,
+                      parallel = true,
+                      auto_detect = false,
+                      columns = {columns_struct})
+    """)
+    row_count = conn.execute(f"SELECT count(*) FROM {TABLE_NAME}").fetchone()[0]
+    logger.info(f"Đã nạp {row_count} dòng vào bảng {TABLE_NAME}.")
+    return row_count
+
+# --- Làm mới incremental theo fingerprint file nguồn ---
+
+def file_sha256(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 của file, đọc theo từng chunk để không tốn bộ nhớ."""
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_stored_fingerprint(conn: duckdb.DuckDBPyConnection,
+                           csv_path: Path) -> Optional[Tuple[int, int, str]]:
+    """Fingerprint (size, mtime_ns, sha256) đã lưu của lần nạp trước, None nếu chưa nạp."""
+    return conn.execute(
+        f"SELECT size_bytes, mtime_ns, sha256 FROM {SOURCE_STATE_TABLE} WHERE source_path = ?",
+        [str(csv_path)]
+    ).fetchone()
+
+def save_fingerprint(conn: duckdb.DuckDBPyConnection, csv_path: Path,
+                     size_bytes: int, mtime_ns: int, sha256: str, row_count: int):
+    """Ghi (hoặc cập nhật) fingerprint của file nguồn."""
+    conn.execute(f"""
+        INSERT OR REPLACE INTO {SOURCE_STATE_TABLE}
+        VALUES (?, ?, ?, ?, ?, current_timestamp)
+    """, [str(csv_path), size_bytes, mtime_ns, sha256, row_count])
+
+def refresh_summary_tables(conn: duckdb.DuckDBPyConnection):
+    """Tính lại các bảng tổng hợp nhỏ (theo thành phố, mã bưu điện, năm sản xuất) từ bảng gốc."""
+    logger.info("Làm mới các bảng tổng hợp...")
+    conn.execute(f"""
+        CREATE OR REPLACE TABLE {CITY_SUMMARY_TABLE} AS
+        SELECT city, count(*) AS vehicle_count
+        FROM {TABLE_NAME}
+        GROUP BY city
+    """)
+    # Mức (postal_code, make, model) đủ để trả lời cả top 3 toàn bang lẫn top theo mã bưu điện
+    conn.execute(f"""
+        CREATE OR REPLACE TABLE {POSTAL_CODE_SUMMARY_TABLE} AS
+        SELECT postal_code, make, model, count(*) AS vehicle_count
+        FROM {TABLE_NAME}
+        GROUP BY postal_code, make, model
+    """)
+    conn.execute(f"""
+        CREATE OR REPLACE TABLE {MODEL_YEAR_SUMMARY_TABLE} AS
+        SELECT model_year, count(*) AS vehicle_count
+        FROM {TABLE_NAME}
+        GROUP BY model_year
+    """)
+
+# --- Chỉ mục lưới không gian ---
+
+def build_grid_index(conn: duckdb.DuckDBPyConnection, cell_degrees: float = GRID_CELL_DEGREES):
+    """
+    Dựng bảng lưới: tọa độ đã parse + (cell_y, cell_x) = floor(tọa độ / cell_degrees),
+    sắp xếp theo ô nên mỗi row group của DuckDB chỉ chứa vài ô liền nhau và
+    zonemap (min/max) của cell_y/cell_x loại bỏ được row group khi lọc theo ô.
+    Kèm bảng đếm số xe mỗi ô cho các truy vấn theo bounding box.
+    """
+    logger.info(f"Dựng chỉ mục lưới {GRID_TABLE} (ô {cell_degrees}°)...")
+    conn.execute(f"""
+        CREATE OR REPLACE TABLE {GRID_TABLE} AS
+        SELECT
+            CAST(floor(latitude / {cell_degrees}) AS INTEGER)  AS cell_y,
+            CAST(floor(longitude / {cell_degrees}) AS INTEGER) AS cell_x,
+            latitude,
+            longitude,
+            dol_vehicle_id,
+            vin,
+            city,
+            postal_code,
+            make,
+            model,
+            ev_type,
+            electric_range
+        FROM {TABLE_NAME}
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+        ORDER BY cell_y, cell_x
+    """)
+    conn.execute(f"""
+        CREATE OR REPLACE TABLE {GRID_CELL_TABLE} AS
+        SELECT cell_y, cell_x, count(*) AS vehicle_count
+        FROM {GRID_TABLE}
+        GROUP BY cell_y, cell_x
+        ORDER BY cell_y, cell_x
+    """)
+
+def ensure_grid_index(conn: duckdb.DuckDBPyConnection):
+    """Dựng chỉ mục lưới nếu database được tạo trước khi có chỉ mục (CSV không đổi nên không nạp lại)."""
+    exists = conn.execute(
+        "SELECT count(*) FROM duckdb_tables() WHERE table_name = ?", [GRID_TABLE]
+    ).fetchone()[0]
+    if not exists:
+        build_grid_index(conn)
+
+def cell_range(min_value: float, max_value: float,
+               cell_degrees: float = GRID_CELL_DEGREES) -> Tuple[int, int]:
+    """Chỉ số ô đầu/cuối phủ đoạn [min_value, max_value] (độ)."""
+    return math.floor(min_value / cell_degrees), math.floor(max_value / cell_degrees)
+
+def radius_bounding_box(lat: float, lon: float, radius_km: float) -> Tuple[float, float, float, float]:
+    """
+    Bounding box (min_lat, min_lon, max_lat, max_lon) chứa trọn vòng tròn bán kính radius_km.
+    Không xử lý vòng tròn vượt kinh tuyến 180° (dữ liệu là xe ở Mỹ).
+    """
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    # Gần cực một độ kinh tuyến ~ 0 km: lấy toàn bộ kinh độ
+    cos_lat = math.cos(math.radians(min(abs(lat) + dlat, 90.0)))
+    dlon = 180.0 if cos_lat < 1e-9 else min(180.0, dlat / cos_lat)
+    return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+def vehicles_within_radius(conn: duckdb.DuckDBPyConnection, lat: float, lon: float,
+                           radius_km: float) -> duckdb.DuckDBPyRelation:
+    """
+    Các xe trong bán kính radius_km quanh (lat, lon), sắp theo khoảng cách.
+    Lọc theo ô lưới trước (chỉ đọc các row group chứa ô giao bounding box),
+    rồi bounding box, cuối cùng mới tính haversine chính xác trên số ít dòng còn lại.
+    """
+    min_lat, min_lon, max_lat, max_lon = radius_bounding_box(lat, lon, radius_km)
+    min_y, max_y = cell_range(min_lat, max_lat)
+    min_x, max_x = cell_range(min_lon, max_lon)
+    return conn.sql(f"""
+        SELECT * EXCLUDE (cell_y, cell_x) FROM (
+            SELECT *, {HAVERSINE_KM_SQL} AS distance_km
+            FROM {GRID_TABLE}
+            WHERE cell_y BETWEEN $min_y AND $max_y
+              AND cell_x BETWEEN $min_x AND $max_x
+              AND latitude BETWEEN $min_lat AND $max_lat
+              AND longitude BETWEEN $min_lon AND $max_lon
+        )
+        WHERE distance_km <= $radius_km
+        ORDER BY distance_km
+    """, params={
+        "lat": lat, "lon": lon, "radius_km": radius_km,
+        "min_y": min_y, "max_y": max_y, "min_x": min_x, "max_x": max_x,
+        "min_lat": min_lat, "max_lat": max_lat, "min_lon": min_lon, "max_lon": max_lon,
+    })
+
+def vehicle_counts_per_cell(conn: duckdb.DuckDBPyConnection, min_lat: float, min_lon: float,
+                            max_lat: float, max_lon: float) -> duckdb.DuckDBPyRelation:
+    """
+    Số xe mỗi ô lưới trong bounding box. Ô nằm trọn trong box lấy thẳng từ bảng
+    đếm GRID_CELL_TABLE; chỉ các ô ở biên mới đếm lại từng xe theo tọa độ chính xác.
+    Kèm tọa độ tâm ô để vẽ heatmap.
+    """
+    min_y, max_y = cell_range(min_lat, max_lat)
+    min_x, max_x = cell_range(min_lon, max_lon)
+    # Ô trọn trong box: (min_y, max_y) nếu biên box trùng biên ô, ngược lại bỏ ô đầu/cuối
+    inner_min_y = min_y if min_lat == min_y * GRID_CELL_DEGREES else min_y + 1
+    inner_min_x = min_x if min_lon == min_x * GRID_CELL_DEGREES else min_x + 1
+    inner_max_y, inner_max_x = max_y - 1, max_x - 1
+    return conn.sql(f"""
+        WITH counts AS (
+            SELECT cell_y, cell_x, vehicle_count
+            FROM {GRID_CELL_TABLE}
+            WHERE cell_y BETWEEN $inner_min_y AND $inner_max_y
+              AND cell_x BETWEEN $inner_min_x AND $inner_max_x
+            UNION ALL
+            SELECT cell_y, cell_x, count(*) AS vehicle_count
+            FROM {GRID_TABLE}
+            WHERE cell_y BETWEEN $min_y AND $max_y
+              AND cell_x BETWEEN $min_x AND $max_x
+              AND NOT (cell_y BETWEEN $inner_min_y AND $inner_max_y
+                       AND cell_x BETWEEN $inner_min_x AND $inner_max_x)
+              AND latitude BETWEEN $min_lat AND $max_lat
+              AND longitude BETWEEN $min_lon AND $max_lon
+            GROUP BY cell_y, cell_x
+        )
+        SELECT cell_y, cell_x,
+               CAST((cell_y + 0.5) * {GRID_CELL_DEGREES} AS DOUBLE) AS center_lat,
+               CAST((cell_x + 0.5) * {GRID_CELL_DEGREES} AS DOUBLE) AS center_lon,
+               vehicle_count
+        FROM counts
+        ORDER BY cell_y, cell_x
+    """, params={
+        "min_lat": min_lat, "max_lat": max_lat, "min_lon": min_lon, "max_lon": max_lon,
+        "min_y": min_y, "max_y": max_y, "min_x": min_x, "max_x": max_x,
+        "inner_min_y": inner_min_y, "inner_max_y": inner_max_y,
+        "inner_min_x": inner_min_x, "inner_max_x": inner_max_x,
+    })
+
+def ensure_loaded(conn: duckdb.DuckDBPyConnection, csv_path: Path) -> bool:
+    """
+    Chỉ nạp lại CSV khi file nguồn thay đổi. So sánh size + mtime trước (rẻ);
+    nếu khác thì tính SHA-256 để xác nhận nội dung thật sự đổi (file chỉ bị touch
+    thì chỉ cập nhật fingerprint). Bảng gốc và các bảng tổng hợp được làm mới
+    trong cùng một transaction. Trả về True nếu đã nạp lại.
+    """
+    if not csv_path.is_file():
+        raise FileNotFoundError(f"Không tìm thấy file CSV: {csv_path}")
+
+    stat = csv_path.stat()
+    stored = get_stored_fingerprint(conn, csv_path)
+    if stored and stored[0] == stat.st_size and stored[1] == stat.st_mtime_ns:
+        logger.info("File nguồn không đổi (size/mtime), dùng dữ liệu đã nạp trong DuckDB.")
+        return False
+
+    sha256 = file_sha256(csv_path)
+    if stored and stored[0] == stat.st_size and stored[2] == sha256:
+        logger.info("mtime thay đổi nhưng nội dung không đổi (cùng SHA-256), chỉ cập nhật fingerprint.")
+        conn.execute(f"UPDATE {SOURCE_STATE_TABLE} SET mtime_ns = ? WHERE source_path = ?",
+                     [stat.st_mtime_ns, str(csv_path)])
+        return False
+
+    logger.info("File nguồn mới hoặc đã thay đổi, nạp lại bảng gốc và bảng tổng hợp...")
+    conn.execute("BEGIN TRANSACTION")
+    try:
+        conn.execute(f"DELETE FROM {TABLE_NAME}")
+        row_count = load_csv(conn, csv_path)
+        refresh_summary_tables(conn)
+        build_grid_index(conn)
+        save_fingerprint(conn, csv_path, stat.st_size, stat.st_mtime_ns, sha256, row_count)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    logger.info("Nạp lại và làm mới bảng tổng hợp hoàn tất.")
+    return True
+
+# --- Các hàm tính toán (Câu 3) ---
+# Các truy vấn đọc từ bảng tổng hợp nhỏ thay vì quét toàn bộ bảng gốc.
+
+def count_cars_per_city(conn: duckdb.DuckDBPyConnection) -> duckdb.DuckDBPyRelation:
+    """Câu 3.1: Đếm số xe điện theo thành phố."""
+    logger.info("Câu 3.1: Đếm số xe điện theo thành phố...")
+    return conn.sql(f"""
+        SELECT city, vehicle_count
+        FROM {CITY_SUMMARY_TABLE}
+        ORDER BY vehicle_count DESC, city
+    """)
+
+def top_3_vehicles(conn: duckdb.DuckDBPyConnection) -> duckdb.DuckDBPyRelation:
+    """Câu 3.2: Top 3 mẫu xe điện phổ biến nhất."""
+    logger.info("Câu 3.2: Top 3 mẫu xe điện phổ biến nhất...")
+    return conn.sql(f"""
+        SELECT make, model, sum(vehicle_count) AS vehicle_count
+        FROM {POSTAL_CODE_SUMMARY_TABLE}
+        GROUP BY make, model
+        ORDER BY vehicle_count DESC, make, model
+        LIMIT 3
+    """)
+
+def top_vehicle_per_postal_code(conn: duckdb.DuckDBPyConnection) -> duckdb.DuckDBPyRelation:
+    """Câu 3.3: Mẫu xe điện phổ biến nhất ở mỗi mã bưu điện."""
+    logger.info("Câu 3.3: Mẫu xe phổ biến nhất theo mã bưu điện...")
+    return conn.sql(f"""
+        SELECT postal_code, make, model, vehicle_count
+        FROM {POSTAL_CODE_SUMMARY_TABLE}
+        QUALIFY row_number() OVER (
+            PARTITION BY postal_code ORDER BY vehicle_count DESC, make, model
+        ) = 1
+        ORDER BY postal_code
+    """)
+
+def write_model_year_counts(conn: duckdb.DuckDBPyConnection,
+                            output_dir: Path = MODEL_YEAR_OUTPUT_DIR) -> Path:
+    """Câu 3.4: Đếm số xe theo năm sản xuất, ghi Parquet partition theo năm."""
+    logger.info(f"Câu 3.4: Ghi số xe theo model_year vào {output_dir} (partition theo năm)...")
+    output_dir.parent.mkdir(parents=True, exist_ok=True)
+    conn.execute(f"""
+        COPY (
+            SELECT model_year, vehicle_count
+            FROM {MODEL_YEAR_SUMMARY_TABLE}
+        ) TO {_sql_literal(str(output_dir))}
+        (FORMAT PARQUET, PARTITION_BY (model_year), OVERWRITE_OR_IGNORE true)
+    """)
+    logger.info(f"Đã ghi Parquet vào {output_dir}")
+    return output_dir
+
+
+def main(csv_path: Path = INPUT_CSV, database: Path = DATABASE_FILE):
+    logger.info("--- Bắt đầu Exercise 8: DuckDB ---")
+    conn = None
+    try:
+        database.parent.mkdir(parents=True, exist_ok=True)
+        conn = create_connection(str(database))
+        create_table(conn)
+        ensure_loaded(conn, csv_path)
+        ensure_grid_index(conn)
+
+        count_cars_per_city(conn).show()
+        top_3_vehicles(conn).show()
+        top_vehicle_per_postal_code(conn).show()
+        write_model_year_counts(conn)
 
-def main():
-    pass
+        nearby = vehicles_within_radius(conn, *SAMPLE_POINT, SAMPLE_RADIUS_KM)
+        logger.info(f"Số xe trong bán kính {SAMPLE_RADIUS_KM} km quanh {SAMPLE_POINT}: "
+                    f"{nearby.aggregate('count(*)').fetchone()[0]}")
+        vehicle_counts_per_cell(conn, *SAMPLE_BBOX).show()
+    except FileNotFoundError as e:
+        logger.error(str(e))
+        exit(1)
+    except duckdb.Error as e:
+        logger.error(f"Lỗi DuckDB: {e}", exc_info=True)
+        exit(1)
+    finally:
+        if conn:
+            conn.close()
+            logger.info("Đã đóng kết nối DuckDB.")
+    logger.info("--- Kết thúc Exercise 8 ---")
 
 
 if __name__ == "__main__":
@@ -1,8 +1,390 @@
+import hashlib
+import json
+import logging
+import os
+import re
+from datetime import date, datetime, timedelta
+from glob import glob
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
 import polars as pl
 
+from result_cache import ResultCache
+
+# --- Cấu hình Logging ---
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+# --- Hằng số và Đường dẫn ---
+DATA_DIR = Path("data")
+# Mỗi tháng Divvy công bố 1 file YYYYMM-divvy-tripdata.csv, glob để đọc tất cả
+INPUT_GLOB = str(DATA_DIR / "*-divvy-tripdata.csv")
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Bộ đệm Parquet: mỗi file CSV tháng được chuyển đổi một lần thành
+# parquet/trips/month=YYYY-MM/<tên file>.parquet, sắp xếp theo started_at
+PARQUET_DIR = Path("parquet") / "trips"
+MANIFEST_FILE = PARQUET_DIR / "_manifest.json"
+# Số dòng mỗi row group: nhỏ hơn thì lọc theo started_at bỏ qua được nhiều hơn
+PARQUET_ROW_GROUP_SIZE = 128_000
+# "incremental" (mặc định): cập nhật state store theo tháng mới;
+# "adhoc": tính lại toàn bộ từ Parquet, có thể giới hạn bằng RIDES_START_DATE/RIDES_END_DATE
+PIPELINE_MODE = os.getenv("EX9_MODE", "incremental")
+# State store của chế độ incremental: số chuyến theo (file nguồn, ngày) và các kết quả đã tính
+STATE_DIR = Path("state")
+DAILY_STATE_FILE = STATE_DIR / "daily_counts.parquet"
+WEEKLY_STATE_FILE = STATE_DIR / "weekly_stats.parquet"
+DELTA_STATE_FILE = STATE_DIR / "daily_vs_last_week.parquet"
+STATE_META_FILE = STATE_DIR / "_state.json"
+DAILY_STATE_SCHEMA = {"source": pl.String, "ride_date": pl.Date, "ride_count": pl.Int64}
+# Khoảng thời gian cần phân tích (chế độ adhoc), ví dụ "2023-06-01"; lọc được đẩy xuống row group
+RIDES_START_DATE = os.getenv("RIDES_START_DATE")
+RIDES_END_DATE = os.getenv("RIDES_END_DATE")
+
+# --- Định nghĩa Schema ---
+# Khai báo kiểu tường minh cho mọi cột thay vì để Polars tự suy luận từ vài dòng đầu
+# (ví dụ end_station_id bị suy luận thành Int64 trong khi có giá trị dạng "TA1309000002").
+# started_at/ended_at đọc dạng chuỗi rồi parse bằng DATETIME_FORMAT trong convert_types.
+TRIP_SCHEMA_OVERRIDES = {
+    "ride_id": pl.String,
+    "rideable_type": pl.String,
+    "started_at": pl.String,
+    "ended_at": pl.String,
+    "start_station_name": pl.String,
+    "start_station_id": pl.String,
+    "end_station_name": pl.String,
+    "end_station_id": pl.String,
+    "start_lat": pl.Float64,
+    "start_lng": pl.Float64,
+    "end_lat": pl.Float64,
+    "end_lng": pl.Float64,
+    "member_casual": pl.String,
+}
+
+
+# --- Các Hàm Xử lý ---
+
+def scan_trips(pattern: str = INPUT_GLOB) -> pl.LazyFrame:
+    """Câu 1: Đọc (lazy) các file CSV Divvy khớp với pattern."""
+    logger.info(f"Câu 1: scan_csv lazy từ {pattern}")
+    return pl.scan_csv(pattern, schema_overrides=TRIP_SCHEMA_OVERRIDES)
+
+def convert_types(lf: pl.LazyFrame) -> pl.LazyFrame:
+    """Câu 2: Chuyển started_at/ended_at sang Datetime (giá trị sai định dạng thành null)."""
+    return lf.with_columns(
+        pl.col("started_at").str.to_datetime(DATETIME_FORMAT, strict=False),
+        pl.col("ended_at").str.to_datetime(DATETIME_FORMAT, strict=False),
+    )
+
+# --- Bộ đệm Parquet ---
+
+def file_fingerprint(path: Path, with_hash: bool = True) -> Dict:
+    """Fingerprint của file nguồn: size, mtime_ns và (tùy chọn) SHA-256 nội dung."""
+    stat = path.stat()
+    fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if with_hash:
+        digest = hashlib.sha256()
+        with path.open("rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        fingerprint["sha256"] = digest.hexdigest()
+    return fingerprint
+
+def load_manifest(manifest_file: Path = MANIFEST_FILE) -> Dict[str, Dict]:
+    """Manifest: tên file CSV -> {fingerprint, parquet}. Rỗng nếu chưa có hoặc hỏng."""
+    if not manifest_file.exists():
+        return {}
+    try:
+        return json.loads(manifest_file.read_text(encoding="utf-8"))
+    except (OSError, ValueError) as e:
+        logger.warning(f"Không đọc được manifest {manifest_file}, sẽ chuyển đổi lại: {e}")
+        return {}
+
+def save_manifest(manifest: Dict[str, Dict], manifest_file: Path = MANIFEST_FILE):
+    """Ghi manifest qua file tạm rồi đổi tên để không để lại manifest ghi dở."""
+    manifest_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = manifest_file.with_suffix(".tmp")
+    tmp_file.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    tmp_file.replace(manifest_file)
+
+def month_partition(csv_path: Path) -> str:
+    """Partition tháng từ tên file dạng YYYYMM-divvy-tripdata.csv -> "2023-06"."""
+    match = re.match(r"(\d{4})(\d{2})", csv_path.name)
+    if not match:
+        raise ValueError(f"Tên file không có tiền tố YYYYMM: {csv_path.name}")
+    return f"{match.group(1)}-{match.group(2)}"
+
+def convert_csv_to_parquet(csv_path: Path, parquet_dir: Path = PARQUET_DIR) -> Path:
+    """
+    Chuyển một file CSV tháng sang Parquet (streaming, không cần vừa RAM).
+    Dữ liệu được sắp xếp theo started_at để thống kê min/max của mỗi row group
+    không chồng lấn nhau -> lọc theo thời gian bỏ qua được cả row group.
+    """
+    target_dir = parquet_dir / f"month={month_partition(csv_path)}"
+    target_dir.mkdir(parents=True, exist_ok=True)
+    target = target_dir / f"{csv_path.stem}.parquet"
+    tmp_target = target.with_suffix(".parquet.tmp")
+    logger.info(f"Chuyển đổi {csv_path} -> {target}")
+    convert_types(scan_trips(str(csv_path))) \
+        .sort("started_at") \
+        .sink_parquet(tmp_target, statistics=True, row_group_size=PARQUET_ROW_GROUP_SIZE)
+    tmp_target.replace(target)
+    return target
+
+def remove_stale_parquet(manifest: Dict[str, Dict], current_sources: Set[str]):
+    """Xóa (tại chỗ) các entry manifest không còn CSV nguồn, cùng file Parquet của chúng."""
+    for source in sorted(set(manifest) - current_sources):
+        parquet_path = Path(manifest.pop(source)["parquet"])
+        logger.info(f"{source}: CSV nguồn không còn, xóa Parquet {parquet_path}")
+        parquet_path.unlink(missing_ok=True)
+        # Thư mục month=... rỗng thì xóa luôn
+        if parquet_path.parent.exists() and not any(parquet_path.parent.iterdir()):
+            parquet_path.parent.rmdir()
+
+def sync_parquet_cache(pattern: str = INPUT_GLOB, parquet_dir: Path = PARQUET_DIR,
+                       manifest_file: Path = MANIFEST_FILE) -> List[Path]:
+    """
+    Đảm bảo mỗi file CSV khớp pattern đã có bản Parquet mới nhất.
+    So sánh size + mtime trước (rẻ); chỉ khi khác mới tính SHA-256,
+    và chỉ chuyển đổi lại khi nội dung thật sự thay đổi.
+    CSV đã bị xóa/đổi tên: bản Parquet và entry manifest của nó cũng bị xóa.
+    Trả về đúng danh sách file Parquet ứng với các CSV hiện có.
+    """
+    manifest = load_manifest(manifest_file)
+    csv_files = sorted(glob(pattern))
+    remove_stale_parquet(manifest, {Path(csv_file).name for csv_file in csv_files})
+    parquet_files = []
+    converted = 0
+    for csv_file in csv_files:
+        csv_path = Path(csv_file)
+        entry = manifest.get(csv_path.name)
+        quick = file_fingerprint(csv_path, with_hash=False)
+        parquet_path = Path(entry["parquet"]) if entry else None
+
+        if entry and parquet_path.exists():
+            old = entry["fingerprint"]
+            if old["size"] == quick["size"] and old["mtime_ns"] == quick["mtime_ns"]:
+                parquet_files.append(parquet_path)
+                continue
+            full = file_fingerprint(csv_path)
+            if old["size"] == full["size"] and old.get("sha256") == full["sha256"]:
+                logger.info(f"{csv_path.name}: chỉ đổi mtime, nội dung không đổi -> giữ Parquet cũ.")
+                entry["fingerprint"] = full
+                parquet_files.append(parquet_path)
+                continue
+        else:
+            full = file_fingerprint(csv_path)
+
+        parquet_path = convert_csv_to_parquet(csv_path, parquet_dir)
+        manifest[csv_path.name] = {"fingerprint": full, "parquet": str(parquet_path)}
+        parquet_files.append(parquet_path)
+        converted += 1
+
+    save_manifest(manifest, manifest_file)
+    logger.info(f"Bộ đệm Parquet: {len(parquet_files)} file, chuyển đổi mới {converted} file.")
+    return parquet_files
+
+def scan_trips_parquet(parquet_files: List[Path]) -> pl.LazyFrame:
+    """
+    Đọc (lazy) đúng các file Parquet do sync_parquet_cache trả về (không glob cả thư mục,
+    để file còn sót lại không bị đọc). Lọc trên started_at và chọn cột được đẩy xuống
+    lúc đọc file: chỉ các cột cần thiết và các row group có thể khớp mới được giải nén.
+    """
+    return pl.scan_parquet([str(path) for path in parquet_files], hive_partitioning=True)
+
+def filter_period(lf: pl.LazyFrame, start_date: Optional[str] = None,
+                  end_date: Optional[str] = None) -> pl.LazyFrame:
+    """Giữ các chuyến có started_at trong [start_date, end_date] (dạng YYYY-MM-DD, bao gồm 2 đầu)."""
+    if start_date:
+        lf = lf.filter(pl.col("started_at") >= datetime.strptime(start_date, "%Y-%m-%d"))
+    if end_date:
+        end = datetime.strptime(end_date, "%Y-%m-%d").replace(hour=23, minute=59, second=59)
+        lf = lf.filter(pl.col("started_at") <= end)
+    return lf
+
+def rides_per_day(lf: pl.LazyFrame) -> pl.LazyFrame:
+    """Câu 3: Đếm số chuyến đi mỗi ngày."""
+    return lf.filter(pl.col("started_at").is_not_null()) \
+        .group_by(pl.col("started_at").dt.date().alias("ride_date")) \
+        .agg(pl.len().cast(pl.Int64).alias("ride_count")) \
+        .sort("ride_date")
+
+def weekly_ride_stats(daily: pl.LazyFrame) -> pl.LazyFrame:
+    """Câu 4: Trung bình, lớn nhất, nhỏ nhất số chuyến đi theo ngày trong mỗi tuần (tuần bắt đầu thứ Hai)."""
+    return daily.group_by(pl.col("ride_date").dt.truncate("1w").alias("week_start")) \
+        .agg(
+            pl.col("ride_count").mean().alias("avg_rides"),
+            pl.col("ride_count").max().alias("max_rides"),
+            pl.col("ride_count").min().alias("min_rides"),
+            pl.col("ride_count").sum().alias("total_rides"),
+            pl.len().alias("days_in_week"),
+        ) \
+        .sort("week_start")
+
+def compare_to_last_week(daily: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Câu 5: Mỗi ngày nhiều/ít hơn bao nhiêu chuyến so với cùng thứ tuần trước.
+    Join theo ngày - 7 thay vì shift(7) để đúng cả khi dữ liệu thiếu ngày.
+    """
+    last_week = daily.select(
+        (pl.col("ride_date") + pl.duration(days=7)).alias("ride_date"),
+        pl.col("ride_count").alias("last_week_ride_count"),
+    )
+    return daily.join(last_week, on="ride_date", how="left") \
+        .with_columns(
+            (pl.col("ride_count") - pl.col("last_week_ride_count")).alias("diff_vs_last_week")
+        ) \
+        .sort("ride_date")
+
+def collect_streaming(lf: pl.LazyFrame) -> pl.DataFrame:
+    """Thực thi plan bằng streaming engine: dữ liệu được xử lý theo batch, không cần vừa RAM."""
+    return lf.collect(engine="streaming")
+
+
+# --- State store (chế độ incremental) ---
+
+def read_state(path: Path) -> Optional[pl.DataFrame]:
+    """Đọc một bảng state; None nếu chưa có."""
+    return pl.read_parquet(path) if path.exists() else None
+
+def write_state(df: pl.DataFrame, path: Path):
+    """Ghi bảng state qua file tạm rồi đổi tên, tránh để lại state ghi dở."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".parquet.tmp")
+    df.write_parquet(tmp_path)
+    tmp_path.replace(path)
+
+def replace_range(state: Optional[pl.DataFrame], updates: pl.DataFrame, column: str,
+                  lower: date, upper: date) -> pl.DataFrame:
+    """Upsert theo khoảng: bỏ các dòng state có column trong [lower, upper] rồi nối phần tính lại."""
+    if state is None:
+        return updates.sort(column)
+    kept = state.filter(~pl.col(column).is_between(lower, upper))
+    return pl.concat([kept, updates]).sort(column)
+
+def daily_counts_by_source(parquet_files: Dict[str, Path]) -> pl.DataFrame:
+    """Số chuyến mỗi ngày của từng file nguồn; chỉ quét các file được truyền vào."""
+    if not parquet_files:
+        return pl.DataFrame(schema=DAILY_STATE_SCHEMA)
+    frames = [
+        rides_per_day(pl.scan_parquet(path)).select(pl.lit(source).alias("source"), "ride_date", "ride_count")
+        for source, path in parquet_files.items()
+    ]
+    return collect_streaming(pl.concat(frames))
+
+def total_daily(daily_state: pl.DataFrame) -> pl.DataFrame:
+    """Cộng số chuyến của các file nguồn về 1 dòng/ngày."""
+    return daily_state.group_by("ride_date") \
+        .agg(pl.col("ride_count").sum()) \
+        .sort("ride_date")
+
+def find_changed_sources(current: Dict[str, str], processed: Dict[str, str]) -> Set[str]:
+    """File nguồn mới, có nội dung khác (sha256) hoặc đã bị xóa so với lần cập nhật trước."""
+    changed = {source for source, sha in current.items() if processed.get(source) != sha}
+    return changed | (set(processed) - set(current))
+
+def update_incremental(parquet_files: List[Path]) -> Tuple[pl.DataFrame, pl.DataFrame, pl.DataFrame]:
+    """
+    Gộp các tháng mới/thay đổi vào state store và chỉ tính lại phần bị ảnh hưởng:
+    thống kê tuần cho các tuần chứa ngày thay đổi (kể cả tuần giáp ranh giữa hai tháng)
+    và chênh lệch so với tuần trước cho các ngày thay đổi cùng 7 ngày sau đó.
+    Chi phí tỷ lệ với tháng mới, không phải toàn bộ lịch sử.
+    """
+    cached = {str(path) for path in parquet_files}
+    current = {
+        source: entry for source, entry in load_manifest().items() if entry["parquet"] in cached
+    }
+    daily_state = read_state(DAILY_STATE_FILE)
+    weekly_state = read_state(WEEKLY_STATE_FILE)
+    delta_state = read_state(DELTA_STATE_FILE)
+    # Thiếu bất kỳ bảng state nào -> coi như chưa xử lý gì, dựng lại từ đầu với state rỗng
+    # (đúng schema, để tháng đầu tiên không có chuyến nào vẫn cho kết quả rỗng thay vì lỗi)
+    processed = {}
+    if STATE_META_FILE.exists() and all(df is not None for df in (daily_state, weekly_state, delta_state)):
+        processed = json.loads(STATE_META_FILE.read_text(encoding="utf-8"))
+    else:
+        daily_state = pl.DataFrame(schema=DAILY_STATE_SCHEMA)
+        weekly_state = weekly_ride_stats(total_daily(daily_state).lazy()).collect()
+        delta_state = compare_to_last_week(total_daily(daily_state).lazy()).collect()
+    changed = find_changed_sources({s: e["fingerprint"]["sha256"] for s, e in current.items()}, processed)
+    if not changed:
+        logger.info("State store đã cập nhật, không có tháng mới.")
+        return total_daily(daily_state), weekly_state, delta_state
+
+    logger.info(f"Cập nhật state store cho {len(changed)} file: {sorted(changed)}")
+    new_rows = daily_counts_by_source(
+        {source: Path(current[source]["parquet"]) for source in changed if source in current}
+    )
+    old_rows = daily_state.filter(pl.col("source").is_in(list(changed)))
+    affected = pl.concat([old_rows["ride_date"], new_rows["ride_date"]])
+    daily_state = pl.concat([daily_state.filter(~pl.col("source").is_in(list(changed))), new_rows])
+
+    if affected.len() > 0:
+        first_day, last_day = affected.min(), affected.max()
+        # Tuần bắt đầu thứ Hai, giống dt.truncate("1w") trong weekly_ride_stats
+        first_week = first_day - timedelta(days=first_day.weekday())
+        last_week = last_day - timedelta(days=last_day.weekday())
+        delta_end = last_day + timedelta(days=7)
+        window_start = min(first_week, first_day - timedelta(days=7))
+        window_end = max(last_week + timedelta(days=6), delta_end)
+
+        # Chỉ các ngày trong cửa sổ ảnh hưởng (và 7 ngày trước đó cho lag-7) được đọc lại
+        window = total_daily(
+            daily_state.filter(pl.col("ride_date").is_between(window_start, window_end))
+        ).lazy()
+        weekly_updates = weekly_ride_stats(window) \
+            .filter(pl.col("week_start").is_between(first_week, last_week)).collect()
+        delta_updates = compare_to_last_week(window) \
+            .filter(pl.col("ride_date").is_between(first_day, delta_end)).collect()
+
+        weekly_state = replace_range(weekly_state, weekly_updates, "week_start", first_week, last_week)
+        delta_state = replace_range(delta_state, delta_updates, "ride_date", first_day, delta_end)
+        logger.info(f"Tính lại tuần {first_week} -> {last_week}, chênh lệch ngày {first_day} -> {delta_end}")
+
+    write_state(daily_state.sort("source", "ride_date"), DAILY_STATE_FILE)
+    write_state(weekly_state, WEEKLY_STATE_FILE)
+    write_state(delta_state, DELTA_STATE_FILE)
+
+    # Ghi danh sách nguồn đã xử lý sau cùng: nếu bị ngắt giữa chừng, lần sau sẽ xử lý lại (idempotent)
+    STATE_META_FILE.write_text(
+        json.dumps({s: e["fingerprint"]["sha256"] for s, e in current.items()}, indent=2), encoding="utf-8"
+    )
+    return total_daily(daily_state), weekly_state, delta_state
 
 def main():
-    pass
+    logger.info("--- Bắt đầu Exercise 9: Polars Lazy ---")
+    # CSV chỉ được parse khi file mới/thay đổi; các lần chạy sau đọc Parquet đã có kiểu
+    parquet_files = sync_parquet_cache()
+    if not parquet_files:
+        logger.error(f"Không tìm thấy file CSV nào khớp với: {INPUT_GLOB}")
+        exit(1)
+
+    if PIPELINE_MODE == "incremental":
+        daily, weekly, delta = update_incremental(parquet_files)
+    else:
+        trips = filter_period(scan_trips_parquet(parquet_files), RIDES_START_DATE, RIDES_END_DATE)
+        # Quét dữ liệu đúng một lần bằng streaming; kết quả theo ngày rất nhỏ (1 dòng/ngày)
+        # nên các phân tích sau chạy trên bảng ngày thay vì quét lại dữ liệu gốc.
+        # Plan + file Parquet không đổi (cùng khoảng ngày) thì lấy kết quả từ result cache.
+        cache = ResultCache()
+        daily = cache.collect(rides_per_day(trips), parquet_files, name="rides_per_day")
+        weekly = weekly_ride_stats(daily.lazy()).collect()
+        delta = compare_to_last_week(daily.lazy()).collect()
+        cache.log_stats()
+
+    logger.info(f"Câu 3: Số chuyến đi mỗi ngày ({daily.height} ngày)")
+    print(daily)
+
+    logger.info("Câu 4: Thống kê số chuyến đi theo tuần")
+    print(weekly)
+
+    logger.info("Câu 5: So sánh với cùng ngày tuần trước")
+    print(delta)
+    logger.info("--- Kết thúc Exercise 9 ---")
 
 
 if __name__ == "__main__":
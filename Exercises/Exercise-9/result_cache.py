@@ -0,0 +1,170 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+import polars as pl
+
+logger = logging.getLogger(__name__)
+
+# --- Hằng số và Đường dẫn ---
+RESULT_CACHE_DIR = Path(os.getenv("RESULT_CACHE_DIR", "cache/results"))
+INDEX_FILE_NAME = "_index.json"
+# Tổng dung lượng tối đa của các kết quả đã lưu; vượt quá thì xóa kết quả lâu nhất chưa dùng (LRU)
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Plan đọc từ DataFrame trong bộ nhớ (DF [...]): text của plan không chứa dữ liệu nên
+# không thể dùng làm khóa, các plan này luôn được thực thi trực tiếp
+IN_MEMORY_SCAN = re.compile(r"^\s*DF \[", re.MULTILINE)
+
+
+class ResultCache:
+    """
+    Memoization kết quả của LazyFrame. Khóa = SHA-256 của plan đã tối ưu
+    (explain(optimized=True), gồm cả filter/projection đã đẩy xuống) + phiên bản Polars
+    + fingerprint (size, mtime) của các file input. Kết quả lưu dạng Arrow IPC trong
+    cache_dir, giới hạn tổng dung lượng bằng LRU; index và thống kê hit/miss nằm
+    trong _index.json nên được giữ giữa các lần chạy (notebook, báo cáo định kỳ).
+    Không có lock: hai process ghi cùng lúc chỉ làm mất vài entry của index.
+    """
+
+    def __init__(self, cache_dir: Path = RESULT_CACHE_DIR, max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_file = cache_dir / INDEX_FILE_NAME
+        self.index = self._load_index()
+        # Thống kê của phiên hiện tại; số liệu cộng dồn nằm trong index["stats"]
+        self.session_stats = {"hits": 0, "misses": 0, "uncacheable": 0, "evictions": 0}
+
+    # --- Index ---
+
+    def _load_index(self) -> Dict:
+        empty = {"entries": {}, "stats": {"hits": 0, "misses": 0, "evictions": 0}}
+        if not self.index_file.exists():
+            return empty
+        try:
+            return json.loads(self.index_file.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Không đọc được index {self.index_file}, bắt đầu cache trống: {e}")
+            return empty
+
+    def _save_index(self):
+        """Ghi index qua file tạm rồi đổi tên để không để lại index ghi dở."""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.index_file.with_suffix(".tmp")
+        tmp_file.write_text(json.dumps(self.index, indent=2), encoding="utf-8")
+        tmp_file.replace(self.index_file)
+
+    def _count(self, stat: str, n: int = 1):
+        self.session_stats[stat] += n
+        if stat in self.index["stats"]:
+            self.index["stats"][stat] += n
+
+    # --- Khóa ---
+
+    @staticmethod
+    def plan_key(plan: str, input_files: Iterable[Path]) -> str:
+        """SHA-256 của plan + phiên bản Polars + fingerprint (tên, size, mtime) từng file input."""
+        digest = hashlib.sha256()
+        digest.update(pl.__version__.encode("utf-8"))
+        digest.update(plan.encode("utf-8"))
+        for path in sorted(str(p) for p in input_files):
+            stat = os.stat(path)
+            digest.update(f"\0{path}\0{stat.st_size}\0{stat.st_mtime_ns}".encode("utf-8"))
+        return digest.hexdigest()
+
+    # --- Thực thi ---
+
+    def collect(self, lf: pl.LazyFrame, input_files: Iterable[Path], name: str = "query",
+                engine: str = "streaming") -> pl.DataFrame:
+        """
+        Trả kết quả đã lưu nếu plan và input không đổi (hit), ngược lại thực thi plan,
+        lưu kết quả rồi dọn cache theo LRU (miss). input_files phải gồm mọi file plan đọc.
+        """
+        plan = lf.explain(optimized=True)
+        if IN_MEMORY_SCAN.search(plan):
+            self._count("uncacheable")
+            return lf.collect(engine=engine)
+
+        key = self.plan_key(plan, input_files)
+        entry = self.index["entries"].get(key)
+        path = self.cache_dir / f"{key}.arrow"
+        if entry and path.exists():
+            df = pl.read_ipc(path)
+            entry["last_access"] = time.time()
+            entry["hits"] += 1
+            self._count("hits")
+            # max_bytes có thể đã giảm từ lần chạy trước
+            self.evict()
+            self._save_index()
+            logger.info(f"Result cache hit: {name} ({key[:12]}, {df.height} dòng)")
+            return df
+
+        start = time.perf_counter()
+        df = lf.collect(engine=engine)
+        elapsed = time.perf_counter() - start
+        self._count("misses")
+        self._store(key, path, df, name, elapsed)
+        logger.info(f"Result cache miss: {name} ({key[:12]}), thực thi {elapsed:.2f}s")
+        return df
+
+    def _store(self, key: str, path: Path, df: pl.DataFrame, name: str, elapsed: float):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".arrow.tmp")
+        df.write_ipc(tmp_path)
+        tmp_path.replace(path)
+        now = time.time()
+        self.index["entries"][key] = {
+            "name": name,
+            "file": path.name,
+            "size": path.stat().st_size,
+            "rows": df.height,
+            "compute_seconds": round(elapsed, 3),
+            "created_at": now,
+            "last_access": now,
+            "hits": 0,
+        }
+        self.evict()
+        self._save_index()
+
+    def evict(self, max_bytes: Optional[int] = None):
+        """Xóa các entry lâu nhất chưa dùng cho đến khi tổng dung lượng <= max_bytes."""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = self.index["entries"]
+        # Entry mất file (bị xóa tay) thì bỏ khỏi index
+        for key in [k for k, e in entries.items() if not (self.cache_dir / e["file"]).exists()]:
+            del entries[key]
+        total = sum(e["size"] for e in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]["last_access"]):
+            if total <= max_bytes:
+                break
+            entry = entries.pop(key)
+            (self.cache_dir / entry["file"]).unlink(missing_ok=True)
+            total -= entry["size"]
+            self._count("evictions")
+            logger.info(f"Result cache evict: {entry['name']} ({key[:12]}, {entry['size']} bytes)")
+
+    def stats(self) -> Dict:
+        """Thống kê hit/miss của phiên hiện tại, cộng dồn, và dung lượng cache."""
+        total = self.index["stats"]
+        lookups = total["hits"] + total["misses"]
+        return {
+            "session": dict(self.session_stats),
+            "total": dict(total),
+            "hit_ratio": total["hits"] / lookups if lookups else 0.0,
+            "entries": len(self.index["entries"]),
+            "size_bytes": sum(e["size"] for e in self.index["entries"].values()),
+            "max_bytes": self.max_bytes,
+        }
+
+    def log_stats(self):
+        s = self.stats()
+        logger.info(
+            f"Result cache: phiên này {s['session']['hits']} hit / {s['session']['misses']} miss "
+            f"({s['session']['uncacheable']} plan không cache được); cộng dồn {s['total']['hits']} hit / "
+            f"{s['total']['misses']} miss (hit ratio {s['hit_ratio']:.1%}), {s['entries']} kết quả, "
+            f"{s['size_bytes']}/{s['max_bytes']} bytes"
+        )
@@ -0,0 +1,157 @@
+import json
+import logging
+import time
+import urllib.error
+import urllib.request
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from pathlib import Path
+from typing import ContextManager, Dict, Iterator, List, Optional
+
+from pyspark.sql import SparkSession
+
+logger = logging.getLogger(__name__)
+
+# --- Hằng số ---
+PROFILE_DIR = Path("profiles")
+TOP_N_STEPS = 5
+# Metric lấy từ REST API của Spark UI (/api/v1/applications/<app>/stages/<id>)
+STAGE_METRICS = [
+    "executorRunTime",
+    "inputBytes",
+    "inputRecords",
+    "outputBytes",
+    "outputRecords",
+    "shuffleReadBytes",
+    "shuffleReadRecords",
+    "shuffleWriteBytes",
+    "shuffleWriteRecords",
+    "memoryBytesSpilled",
+    "diskBytesSpilled",
+]
+# Listener của Spark cập nhật bất đồng bộ: chờ tối đa ngần này để stage báo COMPLETE
+STAGE_POLL_SECONDS = 2.0
+JOB_GROUP_PROPERTY = "spark.jobGroup.id"
+# Các local property do setJobGroup ghi: lưu và khôi phục cùng nhau để bước lồng nhau
+# (hoặc job group do caller đặt) giữ nguyên mô tả trên Spark UI
+JOB_GROUP_PROPERTIES = (JOB_GROUP_PROPERTY, "spark.job.description", "spark.job.interruptOnCancel")
+
+
+class SparkProfiler:
+    """
+    Đo từng bước của pipeline: thời gian, các job/stage Spark mà bước đó kích hoạt
+    và metric của stage (số dòng vào/ra, shuffle, spill). Mỗi bước chạy trong một
+    job group riêng nên statusTracker trả đúng các job của bước đó.
+    """
+
+    def __init__(self, spark: SparkSession, run_name: str, output_dir: Path = PROFILE_DIR):
+        self.spark = spark
+        self.sc = spark.sparkContext
+        self.run_name = run_name
+        self.output_dir = output_dir
+        self.started_at = datetime.now()
+        self.steps: List[Dict] = []
+
+    @contextmanager
+    def step(self, name: str) -> Iterator[None]:
+        """Context manager bao một bước; các action Spark bên trong được gán cho bước này."""
+        group_id = f"{self.run_name}:{len(self.steps)}:{name}"
+        previous_group = {key: self.sc.getLocalProperty(key) for key in JOB_GROUP_PROPERTIES}
+        self.sc.setJobGroup(group_id, name)
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            yield
+        except Exception:
+            status = "failed"
+            raise
+        finally:
+            wall_seconds = time.perf_counter() - start
+            self._restore_job_group(previous_group)
+            self.steps.append(self._collect_step(name, group_id, wall_seconds, status))
+            logger.info(f"[profile] {name}: {wall_seconds:.2f}s")
+
+    def _restore_job_group(self, previous_group: Dict[str, Optional[str]]):
+        # setLocalProperty(key, None) xóa property -> không có job group như trước bước
+        for key, value in previous_group.items():
+            self.sc.setLocalProperty(key, value)
+
+    def _collect_step(self, name: str, group_id: str, wall_seconds: float, status: str) -> Dict:
+        tracker = self.sc.statusTracker()
+        job_ids = sorted(tracker.getJobIdsForGroup(group_id))
+        stage_ids = []
+        for job_id in job_ids:
+            job_info = tracker.getJobInfo(job_id)
+            if job_info:
+                stage_ids.extend(job_info.stageIds)
+        stage_ids = sorted(set(stage_ids))
+        return {
+            "step": name,
+            "status": status,
+            "wall_seconds": round(wall_seconds, 3),
+            "job_ids": job_ids,
+            "stage_ids": stage_ids,
+            "metrics": self._stage_metrics(stage_ids),
+        }
+
+    def _stage_metrics(self, stage_ids: List[int]) -> Optional[Dict[str, int]]:
+        """Cộng metric của các stage (mọi attempt, bỏ stage bị skip); None nếu Spark UI tắt."""
+        ui_url = self.sc.uiWebUrl
+        if not ui_url:
+            return None
+        totals = dict.fromkeys(STAGE_METRICS, 0)
+        for stage_id in stage_ids:
+            for attempt in self._fetch_stage(ui_url, stage_id):
+                if attempt.get("status") == "SKIPPED":
+                    continue
+                for metric in STAGE_METRICS:
+                    totals[metric] += attempt.get(metric, 0)
+        return totals
+
+    def _fetch_stage(self, ui_url: str, stage_id: int) -> List[Dict]:
+        url = f"{ui_url}/api/v1/applications/{self.sc.applicationId}/stages/{stage_id}"
+        deadline = time.monotonic() + STAGE_POLL_SECONDS
+        while True:
+            try:
+                with urllib.request.urlopen(url, timeout=5) as response:
+                    attempts = json.loads(response.read().decode("utf-8"))
+            except (urllib.error.URLError, ValueError) as e:
+                logger.warning(f"Không lấy được metric stage {stage_id}: {e}")
+                return []
+            if all(a.get("status") != "ACTIVE" for a in attempts) or time.monotonic() > deadline:
+                return attempts
+            time.sleep(0.1)
+
+    def slowest_steps(self, top_n: int = TOP_N_STEPS) -> List[Dict]:
+        return sorted(self.steps, key=lambda s: s["wall_seconds"], reverse=True)[:top_n]
+
+    def write_report(self, top_n: int = TOP_N_STEPS) -> Path:
+        """Ghi run profile JSON và log top-N bước chậm nhất."""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        path = self.output_dir / f"{self.run_name}-{self.started_at:%Y%m%d-%H%M%S}.json"
+        profile = {
+            "run_name": self.run_name,
+            "application_id": self.sc.applicationId,
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "total_seconds": round(sum(s["wall_seconds"] for s in self.steps), 3),
+            "spark_conf": dict(self.sc.getConf().getAll()),
+            "steps": self.steps,
+        }
+        path.write_text(json.dumps(profile, indent=2), encoding="utf-8")
+
+        logger.info(f"Top {top_n} bước chậm nhất ({path}):")
+        for s in self.slowest_steps(top_n):
+            metrics = s["metrics"] or {}
+            logger.info(
+                f"  {s['wall_seconds']:>8.2f}s  {s['step']}  jobs={len(s['job_ids'])} "
+                f"stages={len(s['stage_ids'])} in={metrics.get('inputRecords', '-')} "
+                f"out={metrics.get('outputRecords', '-')} "
+                f"shuffle={metrics.get('shuffleReadBytes', 0) + metrics.get('shuffleWriteBytes', 0)}B "
+                f"spill={metrics.get('memoryBytesSpilled', 0) + metrics.get('diskBytesSpilled', 0)}B"
+            )
+        return path
+
+
+def profile_step(profiler: Optional[SparkProfiler], name: str) -> ContextManager:
+    """profiler.step(name), hoặc không làm gì khi không có profiler (tham số tùy chọn)."""
+    return profiler.step(name) if profiler else nullcontext()
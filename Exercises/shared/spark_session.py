@@ -0,0 +1,167 @@
+import logging
+import math
+import os
+import zipfile
+from glob import glob
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Union
+
+from pyspark.sql import SparkSession
+
+logger = logging.getLogger(__name__)
+
+# --- Hằng số ---
+# Profile mặc định, chọn bằng biến môi trường SPARK_PROFILE
+DEFAULT_PROFILE = os.getenv("SPARK_PROFILE", "laptop")
+# Mục tiêu dung lượng dữ liệu mỗi shuffle partition (giống advisoryPartitionSizeInBytes của AQE)
+TARGET_PARTITION_BYTES = 64 * 1024 * 1024
+
+# --- Profiles ---
+# driver_memory/offheap_size là chuỗi kiểu Spark ("4g") hoặc tỷ lệ RAM máy (0.6 = 60%).
+# min/max_partitions chặn số shuffle partition tính từ kích thước input.
+PROFILES: Dict[str, Dict] = {
+    # Máy cá nhân: vài GB RAM, dữ liệu báo cáo KB-MB
+    "laptop": {
+        "master": "local[*]",
+        "driver_memory": "4g",
+        "offheap_size": "512m",
+        "min_partitions": 1,
+        "max_partitions": 32,
+    },
+    # Một máy lớn chạy local mode: driver là executor duy nhất, dùng phần lớn RAM
+    "single_node": {
+        "master": "local[*]",
+        "driver_memory": 0.6,
+        "offheap_size": 0.15,
+        "min_partitions": 8,
+        "max_partitions": 512,
+    },
+    # Cluster: master và tài nguyên do spark-submit/cluster manager cấp
+    "cluster": {
+        "master": None,
+        "driver_memory": None,
+        "executor_memory": "8g",
+        "executor_cores": 4,
+        "offheap_size": "2g",
+        "min_partitions": 64,
+        "max_partitions": 4000,
+    },
+}
+
+# Cấu hình chung cho mọi profile
+COMMON_CONF = {
+    # AQE: gộp partition nhỏ sau shuffle, tách partition lệch khi join
+    "spark.sql.adaptive.enabled": "true",
+    "spark.sql.adaptive.coalescePartitions.enabled": "true",
+    "spark.sql.adaptive.skewJoin.enabled": "true",
+    "spark.sql.adaptive.advisoryPartitionSizeInBytes": str(TARGET_PARTITION_BYTES),
+    # Kryo nhanh và gọn hơn Java serialization cho shuffle/cache dạng RDD
+    "spark.serializer": "org.apache.spark.serializer.KryoSerializer",
+    # Arrow cho toPandas/createDataFrame(pandas); tự quay về cách cũ nếu thiếu pyarrow
+    "spark.sql.execution.arrow.pyspark.enabled": "true",
+    "spark.sql.execution.arrow.pyspark.fallback.enabled": "true",
+    "spark.memory.offHeap.enabled": "true",
+}
+
+
+# --- Các Hàm ---
+
+def physical_memory_bytes() -> Optional[int]:
+    """Tổng RAM vật lý của máy (Linux/macOS); None nếu không xác định được."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def resolve_memory(value: Union[str, float, None]) -> Optional[str]:
+    """Chuyển tỷ lệ RAM (0.6) thành chuỗi Spark ("9g"); chuỗi được giữ nguyên."""
+    if value is None or isinstance(value, str):
+        return value
+    total = physical_memory_bytes()
+    if total is None:
+        return None
+    return f"{max(1, int(total * value / 1024 ** 3))}g"
+
+def file_size_bytes(path: Path) -> int:
+    """
+    Kích thước dữ liệu của một file. Với file .zip là tổng kích thước đã giải nén
+    (ZipInfo.file_size) vì Spark xử lý dữ liệu sau khi giải nén; zip lỗi thì dùng kích thước file.
+    """
+    if path.suffix.lower() == ".zip":
+        try:
+            with zipfile.ZipFile(path) as zf:
+                return sum(info.file_size for info in zf.infolist())
+        except (zipfile.BadZipFile, OSError):
+            pass
+    return path.stat().st_size
+
+def input_size_bytes(input_paths: Iterable[Union[str, Path]]) -> int:
+    """Tổng kích thước các file input; mỗi path có thể là file, thư mục hoặc glob."""
+    total = 0
+    for path in input_paths:
+        for match in glob(str(path)):
+            match = Path(match)
+            if match.is_dir():
+                total += sum(file_size_bytes(f) for f in match.rglob("*") if f.is_file())
+            elif match.is_file():
+                total += file_size_bytes(match)
+    return total
+
+def shuffle_partitions_for(input_bytes: int, min_partitions: int, max_partitions: int) -> int:
+    """Số shuffle partition ~ input / TARGET_PARTITION_BYTES, chặn trong [min, max] của profile."""
+    wanted = math.ceil(input_bytes / TARGET_PARTITION_BYTES) if input_bytes else min_partitions
+    return max(min_partitions, min(max_partitions, wanted))
+
+def build_conf(profile: str, input_bytes: int) -> Dict[str, str]:
+    """Cấu hình Spark cho profile: COMMON_CONF + bộ nhớ + số shuffle partition."""
+    if profile not in PROFILES:
+        raise ValueError(f"Spark profile không hợp lệ: {profile}. Chọn một trong {list(PROFILES)}")
+    settings = PROFILES[profile]
+    conf = dict(COMMON_CONF)
+    conf["spark.sql.shuffle.partitions"] = str(
+        shuffle_partitions_for(input_bytes, settings["min_partitions"], settings["max_partitions"])
+    )
+    # SPARK_DRIVER_MEMORY ghi đè giá trị của profile (ví dụ trong docker-compose)
+    driver_memory = os.getenv("SPARK_DRIVER_MEMORY") or resolve_memory(settings.get("driver_memory"))
+    if driver_memory:
+        conf["spark.driver.memory"] = driver_memory
+    offheap_size = resolve_memory(settings.get("offheap_size"))
+    if offheap_size:
+        conf["spark.memory.offHeap.size"] = offheap_size
+    else:
+        conf["spark.memory.offHeap.enabled"] = "false"
+    if settings.get("executor_memory"):
+        conf["spark.executor.memory"] = settings["executor_memory"]
+    if settings.get("executor_cores"):
+        conf["spark.executor.cores"] = str(settings["executor_cores"])
+    return conf
+
+def create_spark_session(app_name: str, input_paths: Iterable[Union[str, Path]] = (),
+                         profile: Optional[str] = None,
+                         extra_conf: Optional[Dict[str, str]] = None) -> SparkSession:
+    """
+    Tạo SparkSession theo profile (laptop, single_node, cluster) và log cấu hình thực tế.
+    input_paths dùng để ước lượng số shuffle partition; extra_conf ghi đè cấu hình profile.
+    Lưu ý: spark.driver.memory chỉ có tác dụng khi JVM chưa chạy (python main.py),
+    với spark-submit hãy truyền --driver-memory.
+    """
+    profile = profile or DEFAULT_PROFILE
+    input_bytes = input_size_bytes(input_paths)
+    conf = build_conf(profile, input_bytes)
+    conf.update(extra_conf or {})
+    logger.info(f"Đang khởi tạo SparkSession: {app_name} (profile={profile}, input={input_bytes} bytes)")
+
+    builder = SparkSession.builder.appName(app_name)
+    master = PROFILES[profile]["master"]
+    if master:
+        builder = builder.master(master)
+    for key, value in conf.items():
+        builder = builder.config(key, value)
+    spark = builder.getOrCreate()
+
+    # Log giá trị thực tế: cấu hình có thể bị spark-submit/spark-defaults.conf ghi đè
+    effective = spark.sparkContext.getConf()
+    for key in sorted(conf):
+        logger.info(f"  {key} = {effective.get(key, spark.conf.get(key, None))}")
+    logger.info(f"SparkSession đã được tạo thành công (master={spark.sparkContext.master}).")
+    return spark